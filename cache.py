@@ -0,0 +1,332 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                                  cache.py  ##
+##                                                                           ##
+##  This file defines a cache of search results, so that chords which are    ##
+##  requested again and again (G, C, D, Am...) are only searched for once.   ##
+##  The best few options are kept for each chord and instrument, in memory   ##
+##  and optionally in a folder on disk, so any index up to that number is    ##
+##  served without searching.                                                ##
+##                                                                           ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import collections
+import hashlib
+import json
+import os
+import sys
+import types
+
+from errors import err
+
+import find
+import rank
+import constrain
+
+def sources():
+    """
+    returns the paths of find.py and of every module of ThatChord it uses,
+    directly or through other modules (rank.py, fretboard.py...), which are
+    what search results depend on.
+    """
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+    out = set()
+    todo = [find]
+    while todo != []:
+        module = todo.pop()
+        path = os.path.realpath(getattr(module, "__file__", None) or "")
+        if os.path.dirname(path) != script_directory or path in out:
+            continue
+        out.add(path)
+        # modules imported whole, and those things are imported from.
+        for value in vars(module).values():
+            if isinstance(value, types.ModuleType):
+                todo.append(value)
+            elif getattr(value, "__module__", None) in sys.modules:
+                todo.append(sys.modules[value.__module__])
+    return sorted(out)
+
+def version(paths = None):
+    """
+    returns a fingerprint of the files at paths (sources() by default).
+    Results saved on disk by a different version of the search, the ranking
+    or anything they use are not used.
+    """
+    if paths is None:
+        paths = sources()
+    h = hashlib.sha1()
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        with open(path, "rb") as file:
+            h.update(file.read())
+    return h.hexdigest()
+
+class VoicingCache:
+    """
+    Least recently used cache of the best 'depth' options of each chord on
+    each instrument. get takes the same arguments as find.find, and returns
+    the same option.
+
+    size is the number of chords kept in memory. If location is a folder,
+    results are also saved there (one small json file for each chord), so
+    that they outlive the process.
+    """
+    def __init__(self, size = 128, depth = 10, location = None):
+        self.size = size
+        self.depth = depth
+        self.location = location
+        self.version = version()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if location is not None:
+            os.makedirs(location, exist_ok = True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """
+        returns a dict of the cache's hits (in memory and on disk), misses
+        and evictions so far, and its current size.
+        """
+        return {"hits"      : self.hits,
+                "disk_hits" : self.disk_hits,
+                "misses"    : self.misses,
+                "evictions" : self.evictions,
+                "size"      : len(self.entries)}
+
+    def clear(self):
+        """
+        empties the cache in memory (not on disk).
+        """
+        self.entries.clear()
+
+    def path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.location, name + ".json")
+
+    def load(self, key):
+        """
+        returns the options saved on disk for key, or None.
+        """
+        try:
+            with open(self.path(key), "r") as file:
+                saved = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if saved.get("version") != self.version or saved.get("key") != repr(key):
+            return None
+        return saved["options"]
+
+    def save(self, key, options):
+        try:
+            with open(self.path(key), "w") as file:
+                json.dump({"version" : self.version,
+                           "key"     : repr(key),
+                           "options" : options}, file)
+        except OSError:
+            # the disk cache is only there to save time.
+            pass
+
+    def store(self, key, options):
+        self.entries[key] = options
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last = False)
+            self.evictions += 1
+
+    def get(self, chord, nmute = 0, important = 0, index = 1, nfrets = 12,
+            tuning = [], order = [], ranks = [], stringstarts = [],
+            fretspec = 0, **kwargs):
+        """
+        returns find.find(chord, ...) with the same arguments, searching only
+        if the chord hasn't been seen before on this instrument, or if index
+        is deeper than the options kept. Other keyword arguments (engine,
+        table, workers, constraints...) are passed on to find.find.
+        """
+        args = {"nmute"        : nmute,
+                "important"    : important,
+                "nfrets"       : nfrets,
+                "tuning"       : tuning,
+                "order"        : order,
+                "ranks"        : ranks,
+                "stringstarts" : stringstarts,
+                "fretspec"     : fretspec}
+        if index < 1 or index > self.depth:
+            return find.find(chord, index = index, **args, **kwargs)
+
+        key = (tuple(chord), important, nmute, nfrets, tuple(tuning),
+               tuple(order), tuple(stringstarts), tuple(ranks), fretspec,
+               constrain.key(kwargs.get("constraints")))
+        options = self.entries.get(key)
+        if options is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        else:
+            if self.location is not None:
+                options = self.load(key)
+            if options is not None:
+                self.disk_hits += 1
+            else:
+                self.misses += 1
+                options = find.find(chord, index = self.depth, top = True,
+                                    **args, **kwargs)
+                # options cut short by a deadline are not kept.
+                if not find.find.optimal:
+                    return list(options[min(index, len(options)) - 1])
+                if self.location is not None:
+                    self.save(key, options)
+            self.store(key, options)
+
+        # as in find, a too high index gives the worst option there is.
+        return list(options[min(index, len(options)) - 1])
+
+# Ranks worked out by shifting a shape along the neck may be a rounding
+# error away from the ranks rank.rank gives; they are trusted up to this.
+TOLERANCE = 1e-9
+
+class ShapeCache:
+    """
+    Cache for finding the same chord in many keys, e.g. to transpose a whole
+    songbook. get takes the same arguments as find.find, and returns the
+    same option.
+
+    The first time a chord is asked for, all its options are ranked and
+    kept. Moving every fret of an option up by d plays the same chord d
+    semitones up, so the chord in another key is found from the options
+    kept for a key up to max_shift semitones below. Only the options which
+    press one of the lowest d frets of a string (open strings, if d is 1)
+    have to be found afresh. Moving a shape with no open strings only
+    changes how high it is on the neck, so these are looked at in rank order
+    and the search stops as soon as none of the rest can make the cut.
+    """
+    def __init__(self, max_shift = 2):
+        self.max_shift = max_shift
+        self.sources = {}
+        # FOR TESTING PURPOSES - the number of options ranked so far
+        self.ranked = 0
+
+    def get(self, chord, nmute = 0, important = 0, index = 1, nfrets = 12,
+            tuning = [], order = [], ranks = [], stringstarts = [],
+            fretspec = 0, table = None):
+        # as in find, there is no 0th best option.
+        if index < 1:
+            err("fewoptions")
+        chord, chordset, valids, table = find.prepare(chord, nmute, important,
+                                                      nfrets, tuning,
+                                                      stringstarts, fretspec,
+                                                      table)
+        args = (chord, tuning, order, ranks, stringstarts, table)
+        root = chord[0]
+        family = (tuple([(note - root) % 12 for note in chord]), important,
+                  nmute, nfrets, tuple(tuning), tuple(order), tuple(ranks),
+                  tuple(stringstarts[:len(tuning)]), fretspec)
+        sources = self.sources.setdefault(family, {})
+
+        if root in sources:
+            closed, opened = sources[root]
+            return best(sorted(closed + opened)[:index])
+
+        shifts = [(root - source) % 12 for source in sources]
+        if shifts == [] or min(shifts) > self.max_shift:
+            return self.enumerate(sources, root, valids, chordset, index, args)
+        d = min(shifts)
+        return self.shift(sources[(root - d) % 12], d, valids, chordset,
+                          index, nfrets, fretspec, args)
+
+    def enumerate(self, sources, root, valids, chordset, index, args):
+        """
+        Ranks every option of the chord and keeps them, split into those
+        with no open strings, in rank order, and those with open strings.
+        """
+        stringstarts, table = args[4], args[5]
+        scorer = rank.compile_ranks(*args)
+        closed = []
+        opened = []
+        for seq, attempt in enumerate(find.walk(valids, chordset, table)):
+            option = (scorer(attempt), seq, attempt.copy())
+            self.ranked += 1
+            if is_closed(attempt, stringstarts):
+                closed.append(option)
+            else:
+                opened.append(option)
+        closed.sort()
+        sources[root] = (closed, opened)
+        return best(sorted(closed + opened)[:index])
+
+    def shift(self, source, d, valids, chordset, index, nfrets, fretspec,
+              args):
+        """
+        Finds the best 'index' options of the chord from the options kept
+        for the chord d semitones down.
+        """
+        chord, tuning, order, ranks, stringstarts, table = args
+        n = len(valids)
+        start = [max(stringstarts[i], fretspec) for i in range(n)]
+
+        # ties are broken by position in the counter loop, as in find.
+        lookup = [{f : j for j, f in enumerate(l)} for l in valids]
+        strides = [1] * n
+        for i in range(1, n):
+            strides[i] = strides[i - 1] * len(valids[i - 1])
+        def position(frets):
+            return sum([lookup[i][frets[i]] * strides[i] for i in range(n)])
+
+        shortlist = find.Shortlist(index)
+        scorer = rank.compile_ranks(*args)
+        def add(frets):
+            shortlist.add(frets, scorer(frets), position(frets))
+            self.ranked += 1
+
+        # options pressing one of the lowest d frets on some string are not
+        # shifted from anything. Split them by the first such string i.
+        for i in range(n):
+            part = ([[f for f in valids[j] if f == -1 or f >= start[j] + d]
+                     for j in range(i)]
+                    + [[f for f in valids[i] if start[i] <= f < start[i] + d]]
+                    + valids[i + 1:])
+            if not 0 in [len(l) for l in part]:
+                for attempt in find.walk(part, chordset, table):
+                    add(attempt)
+
+        # every other option is an option of the source, shifted up by d.
+        closed, opened = source
+        for r, seq, frets in opened:
+            if max(frets) + d <= nfrets:
+                add([f + d if f != -1 else -1 for f in frets])
+        # shapes without open strings only move up the neck, so only
+        # rank_pitch_hi and rank_pitch_lo change, by d each.
+        offset = d * (ranks[rank.rankfuncs.index(rank.rank_pitch_hi)]
+                      + ranks[rank.rankfuncs.index(rank.rank_pitch_lo)])
+        for r, seq, frets in closed:
+            if (len(shortlist) == index
+                    and r + offset > shortlist.worst() + TOLERANCE):
+                break
+            if max(frets) + d <= nfrets:
+                add([f + d if f != -1 else -1 for f in frets])
+
+        return find.best(shortlist.options())
+
+def is_closed(frets, stringstarts):
+    """
+    returns True if frets has no open strings (every string is pressed or
+    muted).
+    """
+    return all([frets[i] == -1 or frets[i] > stringstarts[i]
+                for i in range(len(frets))])
+
+def best(options):
+    """
+    returns what find returns from a list of (rank, seq, frets) options.
+    """
+    return find.best([(frets, r) for r, seq, frets in options])
@@ -0,0 +1,236 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                              constrain.py  ##
+##                                                                           ##
+##  This file reads and applies constraints on the way a chord is played,    ##
+##  written in braces after the chord, e.g. "G{s6=0, max=7, reach=3}":       ##
+##  - sK=F pins string K (counting from 1, in the order of the tuning) to    ##
+##    fret F, or to being muted if F is x;                                   ##
+##  - sK!F forbids fret F (or muting, if F is x) on string K;                ##
+##  - max=N forbids frets above N;                                           ##
+##  - reach=N forbids pressed frets more than N apart;                       ##
+##  - fingers=N forbids pressing more than N strings;                        ##
+##  - nomute forbids muted strings.                                          ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+from errors import err
+
+def empty():
+    """
+    returns constraints which allow anything.
+    """
+    return {"pins"       : {},
+            "exclude"    : {},
+            "maxfret"    : None,
+            "maxreach"   : None,
+            "maxfingers" : None,
+            "nomute"     : False}
+
+def fret(text):
+    # a fret number, or x for muted
+    if text.strip().upper() == "X":
+        return -1
+    try:
+        return int(text)
+    except ValueError:
+        err("constraint")
+
+def string(text):
+    # a string number, counted from 1 in the request but from 0 here
+    try:
+        out = int(text) - 1
+    except ValueError:
+        err("constraint")
+    if out < 0:
+        err("constraint")
+    return out
+
+def number(text):
+    try:
+        out = int(text)
+    except ValueError:
+        err("constraint")
+    if out < 0:
+        err("constraint")
+    return out
+
+def parse(text):
+    """
+    returns the constraints written in text (the inside of the braces), as
+    a dict: "pins" maps strings (from 0) to frets, "exclude" maps strings to
+    lists of frets, "maxfret", "maxreach" and "maxfingers" are numbers or
+    None, and "nomute" is a bool. Muted is fret -1.
+    """
+    out = empty()
+    for item in text.replace(";", ",").split(","):
+        item = item.strip().lower()
+        if item == "":
+            continue
+        if item == "nomute":
+            out["nomute"] = True
+        elif item[0] == "s" and "=" in item:
+            k, f = item[1:].split("=", 1)
+            out["pins"][string(k)] = fret(f)
+        elif item[0] == "s" and "!" in item:
+            k, f = item[1:].split("!", 1)
+            out["exclude"].setdefault(string(k), []).append(fret(f))
+        elif "=" in item:
+            key, value = item.split("=", 1)
+            key = key.strip()
+            if key == "max":
+                out["maxfret"] = number(value)
+            elif key == "reach":
+                out["maxreach"] = number(value)
+            elif key == "fingers":
+                out["maxfingers"] = number(value)
+            else:
+                err("constraint")
+        else:
+            err("constraint")
+    return out
+
+def extract(request):
+    """
+    Splits a request into the request without its braces, and the
+    constraints written in them (or None if there are none).
+    """
+    if not "{" in request:
+        if "}" in request:
+            err("constraint")
+        return request, None
+    start = request.index("{")
+    end = request.find("}", start)
+    if end == -1 or "{" in request[start + 1:]:
+        err("constraint")
+    return request[:start] + request[end + 1:], parse(request[start + 1:end])
+
+def key(constraints):
+    """
+    returns constraints (or None) in a hashable form, e.g. for cache keys.
+    """
+    if constraints is None:
+        return None
+    return (tuple(sorted(constraints["pins"].items())),
+            tuple(sorted([(i, tuple(sorted(frets))) for i, frets
+                          in constraints["exclude"].items()])),
+            constraints["maxfret"],
+            constraints["maxreach"],
+            constraints["maxfingers"],
+            constraints["nomute"])
+
+def restrict(valids, constraints):
+    """
+    returns valids without the frets the constraints forbid on each string.
+    Raises err("unsatisfiable") if they forbid every fret of a string.
+    """
+    for i in list(constraints["pins"]) + list(constraints["exclude"]):
+        if i >= len(valids):
+            err("constraint")
+    out = []
+    for i in range(len(valids)):
+        frets = valids[i]
+        if constraints["nomute"]:
+            frets = [f for f in frets if f != -1]
+        if constraints["maxfret"] is not None:
+            frets = [f for f in frets if f <= constraints["maxfret"]]
+        if i in constraints["exclude"]:
+            frets = [f for f in frets if not f in constraints["exclude"][i]]
+        if i in constraints["pins"]:
+            frets = [f for f in frets if f == constraints["pins"][i]]
+        # strings with no frets to begin with are find's business.
+        if frets == [] and valids[i] != []:
+            err("unsatisfiable")
+        out.append(frets)
+    return out
+
+def limits(constraints):
+    """
+    returns the (maxreach, maxfingers) limits on whole fret lists, or None
+    if there are none. These are checked on partial fret lists by the
+    search engines (see find.walk_ranked and find.find_bnb).
+    """
+    if constraints is None:
+        return None
+    if constraints["maxreach"] is None and constraints["maxfingers"] is None:
+        return None
+    return (constraints["maxreach"], constraints["maxfingers"])
+
+def candidates(valids, limits, stringstarts):
+    """
+    returns the number of fret lists made of one fret from each list of
+    valids, or if limits are given, a bound on the number of them within
+    the limits. Every fret list within the reach presses frets between some
+    fret p it presses and p + maxreach, so these are counted for each such
+    p, keeping only those with at most maxfingers pressed.
+    """
+    n = len(valids)
+    maxreach, maxfingers = limits or (None, None)
+    lows = [None]
+    if maxreach is not None:
+        lows += sorted(set([f for i in range(n) for f in valids[i]
+                            if f > stringstarts[i]]))
+    total = 0
+    for p in lows:
+        # ways[k] is the number of fret lists so far with k strings pressed.
+        ways = [1]
+        for i in range(n):
+            free = len([f for f in valids[i] if f <= stringstarts[i]])
+            held = len([f for f in valids[i] if f > stringstarts[i]
+                        and (p is None or p <= f <= p + maxreach)])
+            if p is None and maxreach is not None:
+                held = 0
+            new = [0] * (len(ways) + 1)
+            for k in range(len(ways)):
+                new[k] += ways[k] * free
+                new[k + 1] += ways[k] * held
+            if maxfingers is not None:
+                new = new[:maxfingers + 1]
+            ways = new
+        total += sum(ways)
+    return total
+
+def exceeds(limits, lowest, highest, npressed):
+    """
+    returns True if some strings, whose lowest and highest pressed frets
+    are given along with the number of strings pressed, already go beyond
+    the limits. Adding strings can only make this worse. If no string is
+    pressed, lowest should be above highest.
+    """
+    maxreach, maxfingers = limits
+    if maxreach is not None and highest - lowest > maxreach:
+        return True
+    return maxfingers is not None and npressed > maxfingers
+
+def allows(frets, limits, stringstarts):
+    """
+    returns True if the fret list frets is within the limits.
+    """
+    pressed = [frets[i] for i in range(len(frets))
+               if frets[i] > stringstarts[i]]
+    if len(pressed) == 0:
+        return True
+    return not exceeds(limits, min(pressed), max(pressed), len(pressed))
+
+def within(frets, limits, stringstarts):
+    """
+    Same as allows, for a 2d numpy array of fret lists (one per row): returns
+    the boolean array of the rows within the limits.
+    """
+    import numpy as np
+    maxreach, maxfingers = limits
+    pressed = frets > np.array(stringstarts[:frets.shape[1]])
+    keep = np.ones(len(frets), dtype = bool)
+    if maxreach is not None:
+        hi = np.where(pressed, frets, -1).max(axis = 1)
+        lo = np.where(pressed, frets, hi[:, None]).min(axis = 1)
+        keep &= hi - lo <= maxreach
+    if maxfingers is not None:
+        keep &= pressed.sum(axis = 1) <= maxfingers
+    return keep
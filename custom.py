@@ -18,6 +18,7 @@
 import re
 from errors import err
 import dicts
+from pcset import PCSet
 
 # define the structure: separator followed by note
 structure = r"[^A-Ga-gb#0-9]*((\d)(\d)?|[A-Ga-g][b#]?)"
@@ -34,7 +35,11 @@ def pm(s):
         return + 1
     return 0
 
-def interpret(request, remove_duplicates = True):
+def interpret(request, remove_duplicates = True, with_set = False):
+    """
+    takes a string of notes and returns them as a list of numbers. If
+    with_set is True, returns the list along with its PCSet.
+    """
     # make a copy of request which we chop notes off
     rc = request
     # initialise empty request. We will fill this note by note
@@ -70,4 +75,6 @@ def interpret(request, remove_duplicates = True):
 
     if out2 == []:
         err(13)
+    if with_set:
+        return out2, PCSet(out2)
     return out2
\ No newline at end of file
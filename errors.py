@@ -194,4 +194,37 @@ def err(reason):
             + """ of frets."""
         raise ChordError(out)
     
+    # REASON 24: UNKNOWN SEARCH ENGINE
+    if reason in ("engine", 24):
+        out = """Invalid search engine: in the settings file, please set """  \
+            + """the variable engine to be LOOP, NUMPY, BNB or DP."""
+        raise ChordError(out)
+    
+    # REASON 25: INVALID NUMBER OF WORKERS
+    if reason in ("workers", 25):
+        out = """Invalid number of workers: in the settings file, please set"""\
+            + """ the variable workers to be a whole number, or 0 to use """  \
+            + """every core."""
+        raise ChordError(out)
+    
+    # REASON 26: INVALID CONSTRAINTS
+    if reason in ("constraint", 26):
+        out = """Invalid constraints: write them in braces after the chord, """\
+            + """separated by commas, e.g. G{s6=0, s2!3, max=7, reach=3, """  \
+            + """fingers=3, nomute}."""
+        raise ChordError(out)
+    
+    # REASON 27: NO OPTION SATISFIES THE CONSTRAINTS
+    if reason in ("unsatisfiable", 27):
+        out = """No way of playing this chord satisfies the constraints in """\
+            + """braces. Please loosen them."""
+        raise ChordError(out)
+    
+    # REASON 28: NOTHING TO IDENTIFY
+    if reason in ("identify", 28):
+        out = """I can't identify these frets: please give one fret number """\
+            + """on the instrument's neck for each string (x if it is """    \
+            + """muted), with at least one string played."""
+        raise ChordError(out)
+    
     raise ChordError(str(reason))
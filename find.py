@@ -22,11 +22,42 @@ from errors import err
 # import ranking functions
 import rank
 
-def smart_increment(maxes, current, remaining):
-    # How many notes is our chord missing? I.e. how big is the remaining set?
-    # If there is a gap of k notes, then we need to change at least the
-    # first k counters.
-    k = len(remaining)
+# pitch class sets as 12-bit masks
+import pcset
+from pcset import PCSet
+
+# lookup tables of notes on the fretboard
+import fretboard
+
+# hard constraints on the frets (see constrain.py)
+import constrain
+
+# itertools walks the slow strings of the numpy engine in the loop's order
+import itertools
+
+# heapq keeps ranked options in order, only sorting them as far as needed
+import heapq
+
+# os counts the cores for parallel searches
+import os
+
+# time keeps searches with a deadline to it
+import time
+
+# The numpy engine expands the grid of candidates in blocks of at most this
+# many rows, so that memory stays bounded on big instruments.
+NUMPY_BLOCK = 65536
+
+# Below this many candidates (the product of the number of valid frets on
+# each string), find stays serial even if it was given several workers:
+# starting the processes would take longer than the search.
+PARALLEL_THRESHOLD = 200000
+
+def smart_increment(maxes, current, missing):
+    # How many notes is our chord missing? This is 'missing', the size of the
+    # remaining set. If there is a gap of k notes, then we need to change at
+    # least the first k counters.
+    k = missing
     # if n is 0 or 1 then we don't need to skip anything; just increment
     # normally.
     k = max(k - 1, 0)
@@ -40,150 +71,112 @@ def smart_increment(maxes, current, remaining):
         current[i] = 0
     # the counter i will now be set to the number of strings changed, minus 1
     return i + 1
-            
 
-def insert(options, frets, index, r):
-    """
-    N.B. modifies options in place.
-    Inserts frets into options if the rank of frets is lower than some of the
-    current options. Pushes the worse options out of the list.
-    r is the calculated rank of the option 'frets'.
-    """
-    tup = (frets.copy(), r)
-    # start at worse end of list, move all the way to where r is in order
-    l = len(options)
-    i = l
-    while i > 0 and r < options[i - 1][1]:
-        i -= 1
-    if l < index:
-        # in this case, options has not yet reached full size. Just add the opt
-        options.insert(i, tup)
-    elif i < l:
-        # in this case, options is full. Add only if our option beats at least
-        # one thing.
-        options.insert(i, tup)
-        # push out the worst retained option.
-        options.pop()
+def overreach(limits, starts, attempt, bounds, stale):
+    """
+    Helper for walk_changes when there are limits on the reach and the
+    number of fingers (see constrain.limits). bounds[i] is the lowest and
+    highest pressed fret on strings i to n - 1 and how many of them are
+    pressed. Those below stale are out of date, and are worked out again
+    here. Returns 0 if attempt is within the limits. Otherwise, if strings j
+    to n - 1 already go beyond them, returns j + 1 for the highest such j:
+    smart_increment(maxes, current, j + 1) then skips every fret list which
+    shares these strings.
+    """
+    for i in range(stale - 1, -1, -1):
+        f = attempt[i]
+        if f > starts[i]:
+            lo, hi, npressed = bounds[i + 1]
+            bounds[i] = (min(lo, f), max(hi, f), npressed + 1)
+        else:
+            bounds[i] = bounds[i + 1]
+    if not constrain.exceeds(limits, *bounds[0]):
+        return 0
+    j = 0
+    while j + 1 < len(attempt) and constrain.exceeds(limits, *bounds[j + 1]):
+        j += 1
+    return j + 1
+            
 
-def find(chord, nmute = 0, important = 0, index = 1, nfrets = 12,
-         # Below are ranking args (some are also used for finding)
-         tuning = [], order = [], ranks = [], stringstarts = [],
-         # fret specification
-         fretspec = 0,
-         # args to activate for testing
-         keep_full_list = False):
+def walk_changes(valids, chordset, table, limits = None):
     """
-    This function is called in the main file, thatchord.py.
-    
-    In this function, all possible fret positions are considered on each string
-    and are compiled into 'valids'. All positions which give any note
-    in the chord are maintained. This has the disadvantage of considering, e.g.
-    4 copies of C as a valid configuration for the chord C major.
-    
-    The second part of this function tests every possible configuration and
-    calculates their ranks. It maintains a short list of the best options
-    and then outputs the 'index'th best option found (default 0, i.e. best opt)
-    To avoid recalculating ranks, options are stored as tuples.
-    
-    chord is a list of notes.
-    
-    tuning is a list of notes with as many entries as strings.
-    
-    nfrets is the number of frets of the instrument.
-    
-    important, if nonzero, is the number of notes from the requested chord that
-    suffice to "define" the chord.
+    Generator over every valid option, i.e. every choice of one fret per
+    string from valids where muted strings come first and the important
+    notes in chordset (a PCSet) are all played. Options come in the order of
+    the counter loop, where string 0 varies fastest. table is the fretboard
+    table of the instrument (see fretboard.py).
+    If limits on the reach and the number of fingers are given (see
+    constrain.limits), options beyond them are skipped, along with every
+    option sharing the strings which go beyond them.
+    Yields (attempt, changed), where the strings which may have changed
+    since the last option yielded are strings 0 to changed - 1 (all of them
+    for the first option). walk and walk_ranked are built on this.
+    N.B. the same list is yielded every time and changed in place: copy it
+    to keep it.
     """
-    # start by cutting off the chord so that we don't have more distinct notes
-    # than strings to play!
-    if len(chord) > len(tuning):
-        chord = chord[:len(tuning)]
-    # define some basic variables. If 0 important notes, we assume the whole
-    # chord is needed.
-    n = len(tuning)
-    valids = []
-    if important == 0:
-        important = len(chord)
-    # if there are more important notes than strings, cutoff at len(tuning)
-    important = min(important, len(tuning))
-    # create the set of notes we absolutely need in the chord
-    chordset = set(chord[:important])
-    
-    # start by finding all valid positions.
-    for i in range(n):
-        valids.append([])
-        if i < nmute:
-            valids[i].append(-1)
-        for j in range(max(stringstarts[i], fretspec), nfrets + 1):
-            if (tuning[i] + j) % 12 in chord:
-                valids[i].append(j)
-    
-    # we now have a list of possible frets for each string. Iterate through
-    # each combination and filter out the ones that are not satisfactory.
+    n = len(valids)
     maxes = [len(l) for l in valids]
-    
-    # check we have valid options for each string
-    if 0 in maxes:
-        err(5)
-    
-    # all is good to go: initiate at first possibility and make list of valid
-    # options.
+    notes = table["notes"]
     current = [0] * n
-    options = []
     
     # initiate our first attempt as the lowest value on all strings.
     attempt = [valids[i][0] for i in range(n)]
 
     # populate list of note multiplicities. mults[i] is equal to the number of
-    # distinct strings playing i.
+    # distinct strings playing i. Muted strings play no note. played is the
+    # mask of notes with nonzero multiplicity.
     mults = [0] * 12
+    played = 0
     for i in range(n):
-        mults[(tuning[i] + attempt[i]) % 12] += 1
-    # create set of remaining notes: notes that are not played in the current
+        if attempt[i] != -1:
+            note = notes[i][attempt[i]]
+            mults[note] += 1
+            played |= 1 << note
+    # create mask of remaining notes: notes that are not played in the current
     # attempt but needed in the chord.
-    remaining = set()
-    for note in chordset:
-        if mults[note] == 0:
-            remaining.add(note)
+    impmask = int(chordset)
+    remaining = impmask & ~played
+    
+    # pressed frets of each suffix of the strings, for the limits.
+    if limits is not None:
+        starts = table["stringstarts"]
+        bounds = [(rank.BIG, -1, 0)] * (n + 1)
+        stale = n
+    skip = 0
+    changed = n
     
     # want to iterate until we see 000..0 again
     first_value = [0] * n
     first_time  = True
     
-    # FOR TESTING PURPOSES - function attribute
-    find.count = 0
-    if keep_full_list:
-        find.full_list = []
-    
     while first_time or current != first_value:
         first_time = False
         # attempt = [valids[s][current[s]] for s in range(n)]
         
+        # skip fret lists which go beyond the limits.
+        if limits is not None:
+            skip = overreach(limits, starts, attempt, bounds, stale)
+            stale = 0
+        
         # we will assess whether mutes are valid, and then whether sufficiently
         # many notes from the required chord have been hit.
-        # First, see all muted strings. We already know they are < than nmute.
-        
-        muted = [i for i in range(n) if attempt[i] == -1]
-        bool_mute = True
-        if not len(muted) == 0:
-            if not len(muted) == max(muted) + 1:
-                bool_mute = False
-        
-        # Second, check that the attempt covers the important notes.
-        # This is the case iff our remaining set is empty.
-        bool_impo = len(remaining) == 0
-        
-        # if both conditions are satisfied, store the option.
-        if bool_mute and bool_impo:
-            r = rank.rank(attempt, chord, tuning, order, ranks, stringstarts)
-            insert(options, attempt, index, r)
-            # FOR TESTING PURPOSES
-            find.count += 1
-            if keep_full_list:
-                find.full_list.append(attempt.copy())
+        # Check that the attempt covers the important notes first: this is
+        # the case iff our remaining set is empty.
+        if remaining == 0 and skip == 0:
+            # see all muted strings. We already know they are < than nmute.
+            muted = [i for i in range(n) if attempt[i] == -1]
+            if len(muted) == 0 or len(muted) == max(muted) + 1:
+                # this is an option.
+                yield attempt, changed
+                changed = 0
         
         # intelligently increment the current attempt to the next possibility.
-        updated = smart_increment(maxes, current, remaining)
+        updated = smart_increment(maxes, current,
+                                  max(pcset.popcount(remaining), skip))
+        if updated > changed:
+            changed = updated
+        if limits is not None and updated > stale:
+            stale = updated
         # we may have changed the values of several strings.
         # smart_increment has told us how many, and we can update the
         # remaining set by removing notes that are no longer played now that
@@ -191,11 +184,11 @@ def find(chord, nmute = 0, important = 0, index = 1, nfrets = 12,
         for i in range(updated):
             # only remove a note if it was not muted.
             if attempt[i] != -1:
-                old_note = (attempt[i] + tuning[i]) % 12
+                old_note = notes[i][attempt[i]]
                 mults[old_note] -= 1
-                if mults[old_note] == 0 and old_note in chordset:
+                if mults[old_note] == 0:
                     # we have lost all copies of this old note. It is now remaining
-                    remaining.add(old_note)
+                    played &= ~(1 << old_note)
             # update that entry of the attempt to the new value
             attempt[i] = valids[i][current[i]]
         # now calculate the new notes that are being played as a result of
@@ -203,15 +196,1095 @@ def find(chord, nmute = 0, important = 0, index = 1, nfrets = 12,
         for i in range(updated):
             # only add notes if the string is not muted
             if attempt[i] != -1:
-                new_note = (attempt[i] + tuning[i]) % 12
+                new_note = notes[i][attempt[i]]
                 mults[new_note] += 1
-                if mults[new_note] == 1 and new_note in chordset:
+                if mults[new_note] == 1:
                     # then we have just re-introduced this note into our set
                     # of currently played notes. It is no longer remaining.
-                    remaining.remove(new_note)
+                    played |= 1 << new_note
+        remaining = impmask & ~played
+
+def walk(valids, chordset, table, limits = None):
+    """
+    Generator over every valid option, in the order of the counter loop
+    (see walk_changes).
+    N.B. the same list is yielded every time and changed in place: copy it
+    to keep it.
+    """
+    for attempt, changed in walk_changes(valids, chordset, table, limits):
+        yield attempt
+
+def walk_ranked(valids, chordset, table, scorer, limits = None):
+    """
+    Same as walk (limits included), but yields (attempt, rank) where rank
+    is scorer(attempt) for a scorer from rank.compile_ranks. The aggregates the
+    ranking functions need are kept for each suffix of the strings (strings
+    i to n - 1), and as the counter loop only changes the first few strings
+    at each step, only the aggregates of the suffixes starting at those
+    strings are worked out again. So ranking an option costs about as much
+    as the number of strings which changed, bar rank_structure and
+    rank_bass.
+    """
+    n = len(valids)
+    element = scorer.element
+    merge = scorer.merge
+    combine = scorer.combine
+    # suffix[i] is the aggregate of strings i to n - 1.
+    suffix = [rank.IDENTITY] * (n + 1)
+    for attempt, changed in walk_changes(valids, chordset, table, limits):
+        for i in range(changed - 1, -1, -1):
+            suffix[i] = merge(element(i, attempt[i]), suffix[i + 1])
+        yield attempt, combine(attempt, suffix[0])
+
+def pack(frets):
+    """
+    Packs a list of frets into a compact bytes key (muted strings are -1, so
+    everything is shifted up by one).
+    """
+    return bytes([f + 1 for f in frets])
+
+def unpack(key):
+    """
+    Inverse of pack: returns the list of frets.
+    """
+    return [b - 1 for b in key]
+
+class Shortlist:
+    """
+    Keeps the best 'size' options seen so far, as a bounded max-heap with the
+    worst retained option on top. Options are stored as packed bytes keys.
+    
+    Ties in rank are broken by the order options were added in, earlier
+    first, unless a position seq is given with each option. So adding the
+    options of the counter loop one by one keeps the same options as a
+    sorted list of the best 'size' would, but each option costs O(log size)
+    rather than O(size).
+    """
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        self.seen = 0
+    
+    def __len__(self):
+        return len(self.heap)
+    
+    def worst(self):
+        """
+        returns the rank of the worst option kept.
+        """
+        return - self.heap[0][0]
+    
+    def add(self, frets, r, seq = None):
+        """
+        Adds frets, of rank r, if it beats the worst option kept. Pushes the
+        worst option out if the shortlist is full.
+        """
+        if seq is None:
+            seq = self.seen
+        self.seen += 1
+        if len(self.heap) < self.size:
+            heapq.heappush(self.heap, (- r, - seq, pack(frets)))
+            return
+        top = self.heap[0]
+        if - r > top[0] or (- r == top[0] and - seq > top[1]):
+            heapq.heapreplace(self.heap, (- r, - seq, pack(frets)))
+    
+    def options(self):
+        """
+        returns the options kept as a list of (frets, rank) tuples, best
+        first.
+        """
+        return [(unpack(key), - r) for r, seq, key in sorted(self.heap,
+                                                             reverse = True)]
+
+def find_numpy(valids, chord, chordset, index, tuning, order, ranks,
+               stringstarts, table, keep_full_list = False,
+               block = NUMPY_BLOCK, limits = None):
+    """
+    Vectorised alternative to the counter loop in find, selected with
+    engine = "NUMPY". Takes the list of valid frets for each string and
+    returns the list of options, in the same format and order as the loop.
+    Ranks are calculated a block at a time with rank.rank_batch. If index is
+    None, every option is kept.
+    
+    The candidate grid is expanded in blocks: every combination of the first
+    few strings (the ones that vary fastest in the loop) is held in arrays,
+    and the remaining strings are walked one combination at a time. The mute
+    and important note checks are then done on whole blocks at once, as are
+    the limits on reach and fingers if given (see constrain.limits).
+    """
+    import numpy as np
+    
+    n = len(valids)
+    maxes = [len(l) for l in valids]
+    
+    # bitmask of notes we absolutely need in the chord
+    impmask = int(chordset)
+    
+    # arrays of frets for each string, with the note bit each one plays (0 if
+    # the string is muted) and whether it is muted.
+    frets = [np.array(l, dtype = np.int64) for l in valids]
+    bits  = [np.array([table["masks"][i][f] for f in valids[i]])
+             for i in range(n)]
+    mutes = [frets[i] == -1 for i in range(n)]
+    
+    # choose how many low strings go in a block: as many as fit.
+    s = 1
+    size = maxes[0]
+    while s < n and size * maxes[s] <= block:
+        size *= maxes[s]
+        s += 1
+    
+    # expand all combinations of the low strings once. String 0 varies
+    # fastest, as in smart_increment.
+    low = np.unravel_index(np.arange(size), maxes[:s][::-1])
+    low = [low[s - 1 - i] for i in range(s)]
+    low_frets = np.stack([frets[i][low[i]] for i in range(s)], axis = 1)
+    low_bits  = np.zeros(size, dtype = np.int64)
+    for i in range(s):
+        low_bits |= bits[i][low[i]]
+    low_mutes = np.stack([mutes[i][low[i]] for i in range(s)], axis = 1)
+    # muted strings must be the first few strings: no unmuted string may be
+    # followed by a muted one.
+    low_prefix = np.all(low_mutes[:, 1:] <= low_mutes[:, :-1], axis = 1)
+    
+    options_frets  = np.zeros((0, n), dtype = np.int64)
+    options_scores = np.zeros(0)
+    
+    # walk the high strings in the loop's order: string n - 1 slowest.
+    for high in itertools.product(*[range(maxes[i])
+                                    for i in range(n - 1, s - 1, -1)]):
+        high = high[::-1]
+        high_frets = [valids[s + i][high[i]] for i in range(n - s)]
+        high_muted = [f == -1 for f in high_frets]
+        
+        # the high strings must respect the mute rule on their own...
+        if any(high_muted[i] and not high_muted[i - 1]
+               for i in range(1, n - s)):
+            continue
+        ok = low_prefix
+        # ...and if the first high string is muted, so is every low string.
+        if n > s and high_muted[0]:
+            ok = ok & low_mutes[:, s - 1]
+        
+        high_bits = 0
+        for i in range(n - s):
+            if not high_muted[i]:
+                high_bits |= table["masks"][s + i][high_frets[i]]
+        ok = ok & (((low_bits | high_bits) & impmask) == impmask)
+        
+        rows = np.nonzero(ok)[0]
+        if len(rows) == 0:
+            continue
+        
+        block_frets = np.empty((len(rows), n), dtype = np.int64)
+        block_frets[:, :s] = low_frets[rows]
+        block_frets[:, s:] = high_frets
+        if limits is not None:
+            block_frets = block_frets[constrain.within(block_frets, limits,
+                                                         stringstarts)]
+            if len(block_frets) == 0:
+                continue
+        block_scores = rank.rank_batch(block_frets, chord, tuning, order,
+                                       ranks, stringstarts)
+        
+        # FOR TESTING PURPOSES
+        find.count += len(block_frets)
+        if keep_full_list:
+            find.full_list.extend(block_frets.tolist())
+        
+        # merge with the options so far. A stable sort keeps earlier
+        # candidates first among equal ranks, exactly like Shortlist.
+        options_frets  = np.concatenate((options_frets, block_frets))
+        options_scores = np.concatenate((options_scores, block_scores))
+        keep = np.argsort(options_scores, kind = "stable")[:index]
+        options_frets  = options_frets[keep]
+        options_scores = options_scores[keep]
+    
+    return [(options_frets[i].tolist(), options_scores[i].item())
+            for i in range(len(options_scores))]
+
+def bound(ranks, d, n, pmin, pmax, lmin, lmax, nplayed, nmuted, hi, covered,
+          chordmask, suffix):
+    """
+    Lower bound on the rank of any completion of a partial fret list where
+    strings 0 to d - 1 have been assigned. The partial list is summarised by
+    the min and max pressed frets (pmin, pmax) and played frets (lmin, lmax),
+    the numbers of played and muted strings, the highest fret hi and the
+    bitmask of notes covered. suffix holds, for each d, what the unassigned
+    strings can still contribute (see find_bnb).
+    Every term only gets worse as more strings are assigned, except
+    rank_structure and rank_bass which are bounded by 0.
+    """
+    reachable, lowest_hi, lowest_played, forced = suffix[d]
+    
+    # strings after the first played string can't be muted.
+    if nmuted < d:
+        forced = n - d
+    
+    if pmax >= pmin:
+        reach = pmax - pmin
+    else:
+        reach = 0
+    if lmax >= lmin:
+        spread = lmax - lmin
+    else:
+        spread = 0
+    
+    terms = [reach,
+             spread,
+             nplayed + forced,
+             max(hi, lowest_hi),
+             min(lmin, lowest_played),
+             pcset.popcount(chordmask & ~(covered | reachable)),
+             2 ** nmuted - 1]
+    return sum([ranks[i] * terms[i] for i in range(len(terms))
+                if ranks[i] != 0])
+
+def find_bnb(valids, chord, chordset, index, tuning, order, ranks,
+             stringstarts, table, keep_full_list = False, limits = None,
+             deadline = None):
+    """
+    Branch and bound alternative to the counter loop in find, selected with
+    engine = "BNB". Strings are assigned one at a time, depth first, and a
+    lower bound on the rank (see bound) is kept for each partial fret list.
+    Once index options have been found, any partial fret list whose bound is
+    worse than the worst of them is pruned, along with everything below it.
+    So is any partial fret list already beyond the limits on reach and
+    fingers, if given (see constrain.limits).
+    
+    Returns the same options as the loop. Ties are broken by the position
+    each option has in the loop's enumeration, so the order is also the
+    same. Sets find.visited to the number of partial fret lists considered
+    and find.pruned to the number that were pruned.
+    
+    If a deadline is given (a time.monotonic() time), the search is
+    anytime: the frets of each string are tried in order of how little they
+    add to the reach and how low they are, so that good options are found
+    early, and once the deadline has passed (and index options have been
+    found) the search stops and returns the best options found so far.
+    find.optimal is then False.
+    """
+    n = len(valids)
+    maxes = [len(l) for l in valids]
+    
+    # position of each option in the loop's order: string 0 varies fastest.
+    strides = [1] * n
+    for i in range(1, n):
+        strides[i] = strides[i - 1] * maxes[i - 1]
+    
+    chordmask = pcset.mask(chord)
+    impmask = int(chordset)
+    
+    # the bound only holds if no coefficient is negative.
+    pruning = all(r >= 0 for r in ranks)
+    
+    # suffix[d] summarises strings d, d + 1, ...: the notes they can reach,
+    # the least value they force on rank_pitch_hi and rank_pitch_lo, and
+    # how many of them must be played since they can't be muted.
+    big = max(max(l) for l in valids) + 1
+    suffix = [(0, -1, big, 0)]
+    for i in range(n - 1, -1, -1):
+        reachable, lowest_hi, lowest_played, forced = suffix[0]
+        for f in valids[i]:
+            reachable |= table["masks"][i][f]
+        played = [f for f in valids[i] if f >= stringstarts[i]]
+        if len(played) > 0:
+            lowest_played = min(lowest_played, min(played))
+        if not -1 in valids[i]:
+            forced = n - i
+        suffix.insert(0, (reachable, max(lowest_hi, valids[i][0]),
+                          lowest_played, forced))
+    
+    # options are kept by (rank, position in the loop).
+    shortlist = Shortlist(index)
+    scorer = rank.compile_ranks(chord, tuning, order, ranks, stringstarts,
+                                table)
+    frets = [0] * n
+    
+    masks = table["masks"]
+    
+    # whether the deadline stopped the search.
+    expired = False
+    
+    def compact(d, pmin, pmax):
+        # order in which an anytime search tries the frets of string d:
+        # open strings first, then pressed frets by how much they add to the
+        # reach and how high they are, then muting.
+        def key(j):
+            f = valids[d][j]
+            if f == -1:
+                return (2, 0, 0)
+            if f <= stringstarts[d]:
+                return (0, 0, f)
+            if pmax < pmin:
+                return (1, 0, f)
+            return (1, max(pmax, f) - min(pmin, f), f)
+        return sorted(range(maxes[d]), key = key)
+    
+    def search(d, seq, pmin, pmax, lmin, lmax, nplayed, nmuted, hi, covered,
+               npressed):
+        nonlocal expired
+        if expired:
+            return
+        find.visited += 1
+        if (deadline is not None and find.visited % 64 == 0
+                and len(shortlist) == index and time.monotonic() > deadline):
+            expired = True
+            return
+        # can the important notes still be hit?
+        if impmask & ~(covered | suffix[d][0]):
+            find.pruned += 1
+            return
+        if pruning and len(shortlist) == index:
+            lb = bound(ranks, d, n, pmin, pmax, lmin, lmax, nplayed, nmuted,
+                       hi, covered, chordmask, suffix)
+            if lb > shortlist.worst():
+                find.pruned += 1
+                return
+        
+        if d == n:
+            r = scorer(frets)
+            # FOR TESTING PURPOSES
+            find.count += 1
+            if keep_full_list:
+                find.full_list.append(frets.copy())
+            shortlist.add(frets, r, seq)
+            return
+        
+        if deadline is None:
+            js = range(maxes[d])
+        else:
+            js = compact(d, pmin, pmax)
+        for j in js:
+            f = valids[d][j]
+            frets[d] = f
+            if f == -1:
+                # muted strings must all come first.
+                if nmuted == d:
+                    search(d + 1, seq + j * strides[d], pmin, pmax, lmin,
+                           lmax, nplayed, nmuted + 1, max(hi, f), covered,
+                           npressed)
+            elif f > stringstarts[d]:
+                if limits is not None and constrain.exceeds(
+                        limits, min(pmin, f), max(pmax, f), npressed + 1):
+                    find.pruned += 1
+                    continue
+                search(d + 1, seq + j * strides[d], min(pmin, f),
+                       max(pmax, f), min(lmin, f), max(lmax, f), nplayed + 1,
+                       nmuted, max(hi, f), covered | masks[d][f],
+                       npressed + 1)
+            else:
+                search(d + 1, seq + j * strides[d], pmin, pmax, min(lmin, f),
+                       max(lmax, f), nplayed + 1, nmuted, max(hi, f),
+                       covered | masks[d][f], npressed)
+    
+    search(0, 0, big, -1, big, -1, 0, 0, -1, 0, 0)
+    find.optimal = not expired
+    
+    return shortlist.options()
+
+def find_dp_kbest(valids, chord, chordset, k, table, ranks, stringstarts,
+                  limit = None, beam = None, limits = None):
+    """
+    Helper for find_dp. Returns the k best fret lists by the decomposable part
+    of the rank (every ranking function but rank_structure and rank_bass), as
+    a sorted list of (partial rank, position in the loop, frets) tuples.
+    
+    This is a k-best dynamic programme over strings. After assigning strings
+    0 to d - 1, fret lists are grouped by a state: the bitmask of chord notes
+    covered, the min and max pressed and played frets, and whether every
+    string so far is muted. Every remaining term of the rank only depends on
+    this state, so only the k best fret lists of each state are kept.
+    Parts of the state that no nonzero coefficient needs are left at 0.
+    
+    If limit is given, fret lists whose partial rank is bound to end up
+    above limit are dropped. If beam is given, only the beam most promising
+    states are kept after each string: the result is then no longer exact,
+    but it is quick and gives real fret lists to take a limit from.
+    
+    If limits on the reach and the number of fingers are given (see
+    constrain.limits), the state also keeps what they need, and fret
+    lists beyond them are dropped as soon as they are.
+    """
+    n = len(valids)
+    maxes = [len(l) for l in valids]
+    strides = [1] * n
+    for i in range(1, n):
+        strides[i] = strides[i - 1] * maxes[i - 1]
+    
+    chordmask = pcset.mask(chord)
+    impmask = int(chordset)
+    
+    maxreach, maxfingers = limits or (None, None)
+    track_pressed = ranks[0] != 0 or maxreach is not None
+    track_count   = maxfingers is not None
+    track_lmin    = ranks[1] != 0 or ranks[4] != 0
+    track_lmax    = ranks[1] != 0 or ranks[3] != 0
+    
+    # if every string starts at the same fret, played frets are either that
+    # fret or pressed. When pressed frets are tracked anyway, lmin and lmax
+    # then only need to remember whether an open string was played.
+    big = max(max(l) for l in valids) + 1
+    cap = big
+    if track_pressed and len(set(stringstarts[:n])) == 1:
+        cap = stringstarts[0]
+    
+    # notes that strings d, d + 1, ... can still reach, to drop hopeless
+    # states early.
+    reachable = [0] * (n + 1)
+    for i in range(n - 1, -1, -1):
+        reachable[i] = reachable[i + 1]
+        for f in valids[i]:
+            reachable[i] |= table["masks"][i][f]
+    
+    def lower(d, mask, pmin, pmax, lmin, lmax, prefix, fingers):
+        # least that the terms still to come can add, once d strings are set.
+        # Only used when no coefficient is negative.
+        terms = [pmax - pmin if pmax >= pmin else 0,
+                 lmax - lmin if lmax >= lmin else 0,
+                 0 if prefix else n - d,
+                 max(lmax, pmax),
+                 0,
+                 pcset.popcount(chordmask & ~(mask | reachable[d])),
+                 0]
+        return sum([ranks[i] * terms[i] for i in range(len(terms))
+                    if ranks[i] != 0])
+    
+    # state: (mask, pmin, pmax, lmin, lmax, all muted so far, number pressed)
+    states = {(0, big, -1, big, -1, True, 0) : [(0, 0, ())]}
+    
+    for d in range(n):
+        new_states = {}
+        for ((mask, pmin, pmax, lmin, lmax, prefix, fingers),
+             entries) in states.items():
+            for j in range(maxes[d]):
+                f = valids[d][j]
+                add = 0
+                if f == -1:
+                    # muted strings must all come first.
+                    if not prefix:
+                        continue
+                    key = (mask, pmin, pmax, lmin, lmax, True, fingers)
+                else:
+                    add = ranks[2]
+                    if prefix:
+                        # the muted strings end here: d of them.
+                        add += ranks[6] * (2 ** d - 1)
+                    nmask = mask | table["masks"][d][f]
+                    if impmask & ~(nmask | reachable[d + 1]):
+                        continue
+                    npmin, npmax, nlmin, nlmax = pmin, pmax, lmin, lmax
+                    nfingers = fingers
+                    if track_pressed and f > stringstarts[d]:
+                        npmin, npmax = min(pmin, f), max(pmax, f)
+                    if track_count and f > stringstarts[d]:
+                        nfingers += 1
+                    if limits is not None and constrain.exceeds(
+                            limits, npmin, npmax, nfingers):
+                        continue
+                    if track_lmin and f <= cap:
+                        nlmin = min(lmin, f)
+                    if track_lmax:
+                        nlmax = max(lmax, min(f, cap))
+                    key = (nmask, npmin, npmax, nlmin, nlmax, False,
+                           nfingers)
+                step = j * strides[d]
+                new_states.setdefault(key, []).extend(
+                        [(r + add, seq + step, frets + (f,))
+                         for r, seq, frets in entries])
+        
+        states = {}
+        # best rank each state can still hope for, for the beam.
+        promise = {}
+        for key, entries in new_states.items():
+            entries = sorted(entries)[:k]
+            if limit is not None or beam is not None:
+                lb = lower(d + 1, *key)
+                if limit is not None:
+                    entries = [e for e in entries if e[0] + lb <= limit]
+                if entries == []:
+                    continue
+                promise[key] = entries[0][0] + lb
+            states[key] = entries
+        if beam is not None:
+            keep = sorted(states, key = lambda x : promise[x])[:beam]
+            states = {key : states[key] for key in keep}
+    
+    # add the terms which depend on the final state only.
+    out = []
+    for ((mask, pmin, pmax, lmin, lmax, prefix, fingers),
+         entries) in states.items():
+        if impmask & ~mask:
+            continue
+        if cap < big:
+            lmin, lmax = min(lmin, pmin), max(lmax, pmax)
+        terms = [pmax - pmin if pmax >= pmin else 0,
+                 lmax - lmin if lmax >= lmin else 0,
+                 0,
+                 lmax if lmax >= 0 else -1,
+                 lmin,
+                 pcset.popcount(chordmask & ~mask),
+                 2 ** n - 1 if prefix else 0]
+        add = sum([ranks[i] * terms[i] for i in range(len(terms))
+                   if ranks[i] != 0])
+        out.extend([(r + add, seq, frets) for r, seq, frets in entries])
+    return sorted(out)[:k]
+
+def find_dp(valids, chord, chordset, index, tuning, order, ranks,
+            stringstarts, table, keep_full_list = False, limits = None):
+    """
+    Dynamic programming alternative to the counter loop in find, selected
+    with engine = "DP". Never builds the full list of candidates, so it
+    stays quick on instruments with many strings and frets.
+    
+    The k best fret lists by the decomposable part of the rank are found
+    with find_dp_kbest, then ranked in full with rank.rank. rank_structure
+    and rank_bass only ever add something between a known min and max, so
+    once the k-th best decomposable rank is too large for anything further
+    down to make the cut, the result is exact. Otherwise k is doubled.
+    A quick beam search first finds some real options, whose ranks are
+    used to drop hopeless states from the exact passes.
+    Returns the same options as the loop, in the same order. limits are
+    passed on to find_dp_kbest.
+    """
+    n = len(valids)
+    
+    # bounds on what rank_structure and rank_bass can add. These only matter
+    # if their coefficients are negative.
+    nmute = len([l for l in valids if -1 in l])
+    lowest, highest = min(order) - nmute, max(order)
+    most = sum([max(abs(i - lowest), abs(i - highest)) / (2 ** i)
+                for i in range(len(chord))]) / max(n - nmute, 1)
+    lo = min(0, ranks[7] * most) + min(0, ranks[8])
+    
+    scorer = rank.compile_ranks(chord, tuning, order, ranks, stringstarts,
+                                table)
+    def full_ranks(fetched):
+        return sorted([(scorer(frets), seq, list(frets))
+                       for _, seq, frets in fetched])[:index]
+    
+    # the limit only holds if no coefficient is negative.
+    limit = None
+    if all(r >= 0 for r in ranks):
+        options = full_ranks(find_dp_kbest(valids, chord, chordset, index,
+                                           table, ranks, stringstarts,
+                                           beam = 16 * index,
+                                           limits = limits))
+        if len(options) == index:
+            limit = options[-1][0] - lo
+    
+    k = 4 * index + 8
+    while True:
+        fetched = find_dp_kbest(valids, chord, chordset, k, table, ranks,
+                                stringstarts, limit = limit, limits = limits)
+        options = full_ranks(fetched)
+        # stop if there is nothing left, or nothing left can beat the worst
+        # option we keep.
+        if len(fetched) < k:
+            break
+        if len(options) == index and fetched[-1][0] + lo > options[-1][0]:
+            break
+        k *= 2
+        if all(r >= 0 for r in ranks):
+            limit = options[-1][0] - lo
+    
+    # FOR TESTING PURPOSES
+    find.count = len(fetched)
+    if keep_full_list:
+        find.full_list = [list(frets) for _, _, frets in fetched]
+    
+    return [(f, r) for r, seq, f in options]
+
+def position(valids, frets):
+    """
+    Returns the position of frets in the counter loop over valids, where
+    string 0 varies fastest. Ties in rank are broken by this position.
+    """
+    seq = 0
+    stride = 1
+    for i in range(len(valids)):
+        seq += valids[i].index(frets[i]) * stride
+        stride *= len(valids[i])
+    return seq
+
+def find_shard(args):
+    """
+    Runs the counter loop on one shard of the candidates for find_parallel:
+    the options whose first strings are fixed to prefix. Returns the best
+    'index' options of the shard as (frets, rank, position) tuples, where
+    position is in the loop over all candidates, and the number of options
+    in the shard.
+    """
+    (valids, prefix, chord, chordset, index, tuning, order, ranks,
+     stringstarts, table, limits) = args
+    shard = [[f] for f in prefix] + valids[len(prefix):]
+    shortlist = Shortlist(index)
+    scorer = rank.compile_ranks(chord, tuning, order, ranks, stringstarts,
+                                table)
+    count = 0
+    # the loop over a shard meets its options in the same order as the loop
+    # over everything, so the shard's own order breaks ties correctly.
+    for attempt, r in walk_ranked(shard, chordset, table, scorer, limits):
+        shortlist.add(attempt, r)
+        count += 1
+    return ([(frets, r, position(valids, frets))
+             for frets, r in shortlist.options()], count)
+
+def find_parallel(valids, chord, chordset, index, tuning, order, ranks,
+                  stringstarts, table, workers, limits = None):
+    """
+    Runs the counter loop of find on several processes. The candidates are
+    split into shards by their frets on the first string, or on the first
+    two strings if there are too few frets on the first to keep all the
+    workers busy. Each shard keeps its best 'index' options, and these are
+    merged by rank and loop position, so the options come out exactly as
+    they do from the serial loop.
+    Returns None if processes can't be forked on this system, in which case
+    find stays serial.
+    """
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        # other start methods re-run the main script in each worker.
+        return None
+    
+    if len(valids) > 1 and len(valids[0]) < 2 * workers:
+        prefixes = itertools.product(valids[0], valids[1])
+    else:
+        prefixes = [(f,) for f in valids[0]]
+    tasks = [(valids, prefix, chord, chordset, index, tuning, order, ranks,
+              stringstarts, table, limits) for prefix in prefixes]
     
-    # return the worst option in the list of options, which is at the index
-    # requested (default is for options to have 1 entry).
+    shortlist = Shortlist(index)
+    with context.Pool(workers) as pool:
+        for options, count in pool.imap_unordered(find_shard, tasks):
+            for frets, r, seq in options:
+                shortlist.add(frets, r, seq)
+            # FOR TESTING PURPOSES
+            find.count += count
+    return shortlist.options()
+
+def prepare(chord, nmute, important, nfrets, tuning, stringstarts,
+            fretspec = 0, table = None, constraints = None):
+    """
+    Does the set-up shared by find and count_options: cuts the chord down to the
+    number of strings, works out the set of important notes, and lists the
+    valid frets on each string (only those the constraints allow, if given:
+    see constrain.py). Returns (chord, chordset, valids, table),
+    where chordset is the PCSet of important notes and table is the
+    fretboard table of the instrument (built here if not given).
+    """
+    # start by cutting off the chord so that we don't have more distinct notes
+    # than strings to play!
+    if len(chord) > len(tuning):
+        chord = chord[:len(tuning)]
+    # define some basic variables. If 0 important notes, we assume the whole
+    # chord is needed.
+    if important == 0:
+        important = len(chord)
+    # if there are more important notes than strings, cutoff at len(tuning)
+    important = min(important, len(tuning))
+    # create the set of notes we absolutely need in the chord
+    chordset = PCSet(chord[:important])
+    
+    # start by finding all valid positions: look them up on the fretboard.
+    if table is None:
+        table = fretboard.build(tuning, nfrets, stringstarts)
+    valids = fretboard.valids(table, chord, nmute, fretspec)
+    if constraints is not None:
+        valids = constrain.restrict(valids, constraints)
+    
+    # check we have valid options for each string
+    if 0 in [len(l) for l in valids]:
+        err(5)
+    
+    return chord, chordset, valids, table
+
+def count_options(chord, nmute = 0, important = 0, nfrets = 12, tuning = [],
+                  stringstarts = [], fretspec = 0, table = None,
+                  constraints = None):
+    """
+    Returns the number of valid ways of playing the chord, i.e. the number
+    of options find would rank (find.count), without ranking or storing any.
+    
+    This is a dynamic programme over strings. The only things that matter
+    about the strings assigned so far are which important notes they cover,
+    and whether they are all muted (muted strings must come first), so the
+    number of ways of reaching each such state is all we keep. Limits on
+    reach and fingers depend on more than that, so with those the options
+    are walked through and counted instead.
+    """
+    chord, chordset, valids, table = prepare(chord, nmute, important, nfrets,
+                                             tuning, stringstarts, fretspec,
+                                             table, constraints)
+    limits = constrain.limits(constraints)
+    if limits is not None:
+        return sum([1 for attempt in walk(valids, chordset, table, limits)])
+    impmask = int(chordset)
+    
+    # state: (important notes covered, all muted so far)
+    states = {(0, True) : 1}
+    for i in range(len(valids)):
+        new_states = {}
+        for (mask, prefix), ways in states.items():
+            for f in valids[i]:
+                if f == -1:
+                    if not prefix:
+                        continue
+                    key = (mask, True)
+                else:
+                    key = (mask | (table["masks"][i][f] & impmask), False)
+                new_states[key] = new_states.get(key, 0) + ways
+        states = new_states
+    
+    return sum([ways for (mask, _), ways in states.items() if mask == impmask])
+
+def best(options, top = False, constrained = False):
+    """
+    Returns what find returns from its list of (frets, rank) options, best
+    first: the worst option in the list, which is at the index requested
+    (default is for options to have 1 entry), or all of them if top is True.
+    constrained says whether the options were found under constraints, which
+    may be why there are none.
+    """
     if options == []:
-        err(16)
+        err("unsatisfiable" if constrained else 16)
+    if top:
+        return [frets for frets, r in options]
     return options[-1][0]
+
+def find(chord, nmute = 0, important = 0, index = 1, nfrets = 12,
+         # Below are ranking args (some are also used for finding)
+         tuning = [], order = [], ranks = [], stringstarts = [],
+         # fret specification
+         fretspec = 0,
+         # search engine: "LOOP" (reference), "NUMPY" (vectorised), "BNB"
+         # (branch and bound) or "DP" (dynamic programming)
+         engine = "LOOP",
+         # fretboard table from settings (built here if not given)
+         table = None,
+         # number of processes for the counter loop (0 for one per core)
+         workers = 1,
+         # return the best 'index' options rather than the 'index'th
+         top = False,
+         # library of voicings to look the chord up in (see library.py)
+         library = None,
+         # hard constraints on the frets (see constrain.py)
+         constraints = None,
+         # time in milliseconds to answer in, if any
+         deadline_ms = None,
+         # args to activate for testing
+         keep_full_list = False):
+    """
+    This function is called in the main file, thatchord.py.
+    
+    In this function, all possible fret positions are considered on each string
+    and are compiled into 'valids'. All positions which give any note
+    in the chord are maintained. This has the disadvantage of considering, e.g.
+    4 copies of C as a valid configuration for the chord C major.
+    
+    The second part of this function tests every possible configuration and
+    calculates their ranks. It maintains a short list of the best options
+    and then outputs the 'index'th best option found (default 0, i.e. best opt)
+    To avoid recalculating ranks, options are stored as tuples.
+    
+    chord is a list of notes.
+    
+    tuning is a list of notes with as many entries as strings.
+    
+    nfrets is the number of frets of the instrument.
+    
+    important, if nonzero, is the number of notes from the requested chord that
+    suffice to "define" the chord.
+    
+    table is the fretboard table of the instrument (see fretboard.py), which
+    settings.get_settings provides. Notes are looked up there.
+    
+    engine chooses how candidates are enumerated. "LOOP" is the counter loop
+    below; "NUMPY" (see find_numpy) checks candidates in blocks with numpy;
+    "BNB" (see find_bnb) prunes candidates which can't make the cut; "DP"
+    (see find_dp) never lists candidates that can't make the cut. All of
+    them return the same option.
+    
+    workers is the number of processes the "LOOP" engine may share the
+    search between (see find_parallel), or 0 for one per core. Searches with
+    fewer than PARALLEL_THRESHOLD candidates (within the constraints), or
+    which keep the full list, stay serial.
+    
+    If top is True, the list of the best 'index' options is returned, best
+    first, rather than just the 'index'th (which is the last of them, or the
+    worst option if there are fewer).
+    
+    If a library of voicings of the instrument is given, the chord is looked
+    up there, and the engine is only used if the library can't be sure of
+    the answer. find.count is then the number of options in the library.
+    
+    constraints (see constrain.parse) rule options out rather than rank
+    them. Frets they forbid on a string are left out of valids, and limits
+    on the reach and the number of fingers are checked by every engine as
+    the frets are chosen, so whole families of options are skipped at once.
+    The options are those find gives without constraints, bar the ones the
+    constraints rule out, in the same order.
+    
+    If deadline_ms is given, the search is an anytime search (see find_bnb)
+    whatever the engine, which stops after about deadline_ms milliseconds
+    with the best options found so far, rather than going on until every
+    candidate has been looked at. find.optimal says whether the options are
+    known to be the best ones (it is always True without a deadline). The
+    search only stops once it has found index options, so it may go on
+    longer if there are few of them.
+    """
+    if deadline_ms is not None:
+        deadline = time.monotonic() + deadline_ms / 1000
+    if not engine in ["LOOP", "NUMPY", "BNB", "DP"]:
+        err("engine")
+    # there is no 0th best option.
+    if index < 1:
+        err("fewoptions")
+    
+    chord, chordset, valids, table = prepare(chord, nmute, important, nfrets,
+                                             tuning, stringstarts, fretspec,
+                                             table, constraints)
+    limits = constrain.limits(constraints)
+    
+    # FOR TESTING PURPOSES - function attribute
+    find.count = 0
+    find.visited = 0
+    find.pruned = 0
+    find.optimal = True
+    if keep_full_list:
+        find.full_list = []
+    
+    if (library is not None and not keep_full_list
+            and library.matches(tuning, nfrets, nmute, stringstarts)):
+        options = library.search(chord, chordset, valids, index, tuning,
+                                 order, ranks, stringstarts, limits)
+        if options is not None:
+            return best(options, top, constraints is not None)
+    
+    if deadline_ms is not None:
+        options = find_bnb(valids, chord, chordset, index, tuning, order,
+                           ranks, stringstarts, table, keep_full_list,
+                           limits = limits, deadline = deadline)
+        return best(options, top, constraints is not None)
+    
+    if engine in ["NUMPY", "BNB", "DP"]:
+        engines = {"NUMPY" : find_numpy, "BNB" : find_bnb, "DP" : find_dp}
+        options = engines[engine](valids, chord, chordset, index, tuning,
+                                  order, ranks, stringstarts, table,
+                                  keep_full_list, limits = limits)
+        return best(options, top, constraints is not None)
+    
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    ncandidates = constrain.candidates(valids, limits, stringstarts)
+    if (workers > 1 and not keep_full_list
+            and ncandidates >= PARALLEL_THRESHOLD):
+        options = find_parallel(valids, chord, chordset, index, tuning, order,
+                                ranks, stringstarts, table, workers, limits)
+        if options is not None:
+            return best(options, top, constraints is not None)
+    
+    # we now have a list of possible frets for each string. Iterate through
+    # each combination and keep the best of the satisfactory ones.
+    shortlist = Shortlist(index)
+    scorer = rank.compile_ranks(chord, tuning, order, ranks, stringstarts,
+                                table)
+    for attempt, r in walk_ranked(valids, chordset, table, scorer, limits):
+        shortlist.add(attempt, r)
+        # FOR TESTING PURPOSES
+        find.count += 1
+        if keep_full_list:
+            find.full_list.append(attempt.copy())
+    
+    return best(shortlist.options(), top, constraints is not None)
+
+def find_many(chords, nmute = 0, important = 0, index = 1, nfrets = 12,
+              tuning = [], order = [], ranks = [], stringstarts = [],
+              fretspec = 0, table = None):
+    """
+    Finds the 'index'th best option for each chord in the list chords, as
+    find would, but sharing the work between chords. The fretboard table is
+    built once, and chords which play the same notes (e.g. C6 and Am7/C) have
+    their options listed once. Options are then ranked once for each
+    different ordering of the notes, since rank_structure and rank_bass
+    depend on it. Returns a list of fret lists, one for each chord.
+    """
+    if index < 1:
+        err("fewoptions")
+    if table is None:
+        table = fretboard.build(tuning, nfrets, stringstarts)
+    
+    # options of each set of notes, and rankings of each ordering.
+    listed = {}
+    found = {}
+    out = []
+    for chord in chords:
+        chord, chordset, valids, table = prepare(chord, nmute, important,
+                                                 nfrets, tuning, stringstarts,
+                                                 fretspec, table)
+        ordering = tuple(chord)
+        if not ordering in found:
+            # valids only depend on the notes of the chord, and walk only on
+            # valids and the important notes.
+            key = (PCSet(chord), chordset)
+            if not key in listed:
+                listed[key] = [attempt.copy() for attempt in
+                               walk(valids, chordset, table)]
+            shortlist = Shortlist(index)
+            scorer = rank.compile_ranks(chord, tuning, order, ranks,
+                                        stringstarts, table)
+            for attempt in listed[key]:
+                shortlist.add(attempt, scorer(attempt))
+            options = shortlist.options()
+            if options == []:
+                err(16)
+            found[ordering] = options[-1][0]
+        out.append(found[ordering].copy())
+    
+    # FOR TESTING PURPOSES - the number of times options were listed
+    find_many.listed = len(listed)
+    return out
+
+class Ranked:
+    """
+    All the ways of playing a chord, in rank order, behind a cursor.
+    Takes the same arguments as find, bar index.
+    
+    The search is done once, when this is created. After that, Ranked[i]
+    is the (i + 1)th best option, as returned by find with index = i + 1,
+    and next(Ranked) moves the cursor along to the next best option, so
+    paging through alternatives never repeats the search.
+    
+    With the LOOP engine, options are ranked and put in a heap, and only
+    sorted as far as they are asked for. The NUMPY engine sorts them all.
+    """
+    def __init__(self, chord, nmute = 0, important = 0, nfrets = 12,
+                 tuning = [], order = [], ranks = [], stringstarts = [],
+                 fretspec = 0, engine = "LOOP", table = None):
+        if not engine in ["LOOP", "NUMPY"]:
+            err("engine")
+        chord, chordset, valids, table = prepare(chord, nmute, important,
+                                                 nfrets, tuning, stringstarts,
+                                                 fretspec, table)
+        find.count = 0
+        if engine == "NUMPY":
+            self.heap = []
+            self.sorted = [frets for frets, r in
+                           find_numpy(valids, chord, chordset, None, tuning,
+                                      order, ranks, stringstarts, table)]
+        else:
+            # ties are broken by the order options were found, as in find.
+            scorer = rank.compile_ranks(chord, tuning, order, ranks,
+                                        stringstarts, table)
+            self.heap = [(r, i, frets.copy())
+                         for i, (frets, r) in
+                         enumerate(walk_ranked(valids, chordset, table,
+                                               scorer))]
+            heapq.heapify(self.heap)
+            self.sorted = []
+        self.length = len(self.heap) + len(self.sorted)
+        # FOR TESTING PURPOSES
+        find.count = self.length
+        if self.length == 0:
+            err(6)
+        # position of the cursor: the index of the next option to be given.
+        self.cursor = 0
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("there are only " + str(self.length) +
+                             " options")
+        while len(self.sorted) <= i:
+            self.sorted.append(heapq.heappop(self.heap)[2])
+        return self.sorted[i]
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self.cursor >= self.length:
+            raise StopIteration
+        self.cursor += 1
+        return self[self.cursor - 1]
+    
+    def page(self, start, size):
+        """
+        returns the options from index start (counting from 0) onwards, at
+        most size of them. Moves the cursor to the end of the page.
+        """
+        end = min(start + size, self.length)
+        self.cursor = end
+        return [self[i] for i in range(start, end)]
+
+class Candidates:
+    """
+    Every way of playing a chord, with the value of each ranking function
+    for each of them, so that the options can be ranked again with other
+    ranks coefficients without searching again. Takes the same arguments as
+    find, bar index and ranks. Needs numpy.
+    
+    find(ranks, index) then returns what find would with these ranks. Ranks
+    are added up one ranking function at a time, as in rank.rank_batch, so
+    they are exactly those rank.rank gives and ties come out the same.
+    """
+    def __init__(self, chord, nmute = 0, important = 0, nfrets = 12,
+                 tuning = [], order = [], stringstarts = [], fretspec = 0,
+                 table = None):
+        import numpy as np
+        chord, chordset, valids, table = prepare(chord, nmute, important,
+                                                 nfrets, tuning, stringstarts,
+                                                 fretspec, table)
+        # rows are in the order of the counter loop, so the row number
+        # breaks ties.
+        self.frets = np.array([attempt.copy() for attempt in
+                               walk(valids, chordset, table)],
+                              dtype = np.int64).reshape(-1, len(tuning))
+        if len(self.frets) == 0:
+            err(6)
+        self.features = rank.features(self.frets, chord, tuning, order,
+                                      stringstarts)
+        # FOR TESTING PURPOSES
+        find.count = len(self.frets)
+    
+    def __len__(self):
+        return len(self.frets)
+    
+    def scores(self, ranks):
+        """
+        returns the array of ranks of every option with these coefficients.
+        """
+        out = self.features[:, 0] * 0
+        for i in range(len(ranks)):
+            if ranks[i] != 0:
+                out = out + ranks[i] * self.features[:, i]
+        return out
+    
+    def options(self, ranks, index = 1):
+        """
+        returns the best 'index' options with these coefficients, best first.
+        """
+        import numpy as np
+        if index < 1:
+            err("fewoptions")
+        scores = self.scores(ranks)
+        index = min(index, len(scores))
+        # only sort the options which rank no worse than the index'th.
+        cut = np.partition(scores, index - 1)[index - 1]
+        rows = np.flatnonzero(scores <= cut)
+        rows = rows[np.lexsort((rows, scores[rows]))][:index]
+        return [self.frets[i].tolist() for i in rows]
+    
+    def find(self, ranks, index = 1):
+        """
+        returns the 'index'th best option with these coefficients, as find
+        would.
+        """
+        return self.options(ranks, index)[-1]
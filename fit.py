@@ -0,0 +1,193 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                                    fit.py  ##
+##                                                                           ##
+##  This file fits the ranks coefficients to a corpus of chords with the     ##
+##  way of playing them that people prefer, i.e. it looks for coefficients   ##
+##  for which ThatChord's first choice (or one of its first five) is the     ##
+##  preferred one as often as possible. Run it with                          ##
+##      python3 fit.py corpus.yml                                            ##
+##  where corpus.yml is a list of entries such as                            ##
+##      - chord: G                                                           ##
+##        instrument: GUITAR                                                 ##
+##        frets: [3, 2, 0, 0, 0, 3]                                          ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import random
+
+import interpret
+import custom
+import find
+import settings
+
+# Coefficients are searched among the whole numbers from 0 to this.
+HIGHEST = 10
+
+# Problems being fitted, for the worker processes of evaluate_many (which
+# inherit them when forked, rather than having them sent over).
+PROBLEMS = []
+
+def load_corpus(path):
+    """
+    returns the list of entries in a corpus file.
+    """
+    import yaml
+    with open(path, "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
+def problems(corpus):
+    """
+    Turns a corpus into a list of (candidates, row) problems: candidates is
+    a find.Candidates of all the ways of playing the chord on the instrument,
+    and row is the preferred one. The ranking functions are calculated once
+    here, for every coefficient tried afterwards. Entries whose preferred
+    frets are not a valid option are left out.
+    """
+    import numpy as np
+    instruments = {}
+    chords = {}
+    out = []
+    for entry in corpus:
+        name = entry["instrument"].upper()
+        if not name in instruments:
+            instruments[name], _, _ = settings.get_settings(
+                    instrument_preset = name)
+        s = instruments[name]
+        key = (entry["chord"], name)
+        if not key in chords:
+            request = entry["chord"]
+            if request[0:6].upper() == "CUSTOM":
+                chord = custom.interpret(request[6:])
+            else:
+                chord = interpret.interpret(request)
+            chords[key] = find.Candidates(chord,
+                                          nmute = s["nmute"],
+                                          important = s["important"],
+                                          nfrets = s["nfrets"],
+                                          tuning = s["tuning"],
+                                          order = s["order"],
+                                          stringstarts = s["stringstarts"],
+                                          table = s["fretboard"])
+        candidates = chords[key]
+        rows = np.flatnonzero((candidates.frets ==
+                               np.array(entry["frets"])).all(axis = 1))
+        if len(rows) == 1:
+            out.append((candidates, rows[0]))
+    return out
+
+def evaluate(problems, ranks):
+    """
+    returns the proportion of problems where the preferred way of playing
+    the chord comes first with these ranks coefficients, and the proportion
+    where it is in the first five.
+    """
+    import numpy as np
+    top1 = 0
+    top5 = 0
+    for candidates, row in problems:
+        scores = candidates.scores(ranks)
+        # place of the preferred option, ties broken by row as in find.
+        place = (np.count_nonzero(scores < scores[row])
+                 + np.count_nonzero(scores[:row] == scores[row]))
+        top1 += int(place < 1)
+        top5 += int(place < 5)
+    return top1 / len(problems), top5 / len(problems)
+
+def evaluate_one(ranks):
+    return evaluate(PROBLEMS, ranks)
+
+def evaluate_many(problems, trials, workers = 1):
+    """
+    returns the list of evaluate(problems, ranks) for each ranks in trials,
+    shared between several processes if workers > 1 (and processes can be
+    forked on this system).
+    """
+    global PROBLEMS
+    if workers > 1:
+        import multiprocessing
+        try:
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = None
+        if context is not None:
+            PROBLEMS = problems
+            try:
+                with context.Pool(workers) as pool:
+                    return pool.map(evaluate_one, trials,
+                                    chunksize = max(1, len(trials)
+                                                    // (4 * workers)))
+            finally:
+                PROBLEMS = []
+    return [evaluate(problems, ranks) for ranks in trials]
+
+def fit(problems, start = None, trials = 1000, workers = 1, seed = 0,
+        highest = HIGHEST):
+    """
+    Searches for the ranks coefficients which put the preferred options
+    first most often (then in the first five most often). Tries start and
+    some random coefficients, then improves the best of them one coefficient
+    at a time until no change helps. Returns the coefficients found and
+    their (top 1, top 5) agreement.
+    """
+    rng = random.Random(seed)
+    n = len(problems[0][0].features[0])
+    tried = [list(start or [1] * n)]
+    tried += [[rng.randint(0, highest) for i in range(n)]
+              for t in range(trials)]
+    results = evaluate_many(problems, tried, workers)
+    best = max(range(len(tried)), key = lambda t: results[t])
+    ranks, score = tried[best], results[best]
+
+    improved = True
+    while improved:
+        improved = False
+        tried = []
+        for i in range(n):
+            for value in range(highest + 1):
+                if value != ranks[i]:
+                    tried.append(ranks[:i] + [value] + ranks[i + 1:])
+        results = evaluate_many(problems, tried, workers)
+        for t in range(len(tried)):
+            if results[t] > score:
+                ranks, score = tried[t], results[t]
+                improved = True
+    return ranks, score
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(prog = "fit.py",
+                                     usage = "python3 fit.py <corpus> [OPTIONS]")
+    parser.add_argument("corpus", nargs = 1, type = str,
+                        help = ".yml file of chords and preferred frets")
+    parser.add_argument("-r", "--ranking", nargs = "?", type = str,
+                        help = "ranking preset to start from")
+    parser.add_argument("-t", "--trials", nargs = "?", type = int,
+                        default = 1000,
+                        help = "number of random coefficients to try")
+    parser.add_argument("-w", "--workers", nargs = "?", type = int,
+                        default = 0,
+                        help = "number of processes (0 for one per core)")
+    args = parser.parse_args()
+
+    start = None
+    if args.ranking:
+        start = settings.get_settings(ranking_preset = args.ranking)[0]["ranks"]
+    found = problems(load_corpus(args.corpus[0]))
+    if found == []:
+        print("No entry of the corpus is a valid way of playing its chord.")
+        exit()
+    ranks, (top1, top5) = fit(found, start, args.trials,
+                              args.workers or os.cpu_count() or 1)
+    print("ranks: " + str(ranks))
+    print("top 1: %.1f%%, top 5: %.1f%% of %d chords" % (100 * top1,
+                                                          100 * top5,
+                                                          len(found)))
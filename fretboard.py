@@ -0,0 +1,78 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                              fretboard.py  ##
+##                                                                           ##
+##  This file builds lookup tables for the fretboard of an instrument: the   ##
+##  note played at each fret of each string, and the other way round, the    ##
+##  frets of each string playing each note. They are built once for each     ##
+##  instrument, so that find.py and rank.py don't have to keep working out   ##
+##  (tuning + fret) % 12.                                                    ##
+##                                                                           ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import functools
+
+@functools.lru_cache(maxsize = 32)
+def cached(tuning, nfrets, stringstarts):
+    # tuning and stringstarts are tuples here, so that they can be cached.
+    n = len(tuning)
+
+    # notes[i][j] is the note on string i at fret j. The extra entry at the
+    # end means notes[i][-1] is -1: a muted string plays no note.
+    notes = tuple(tuple([(tuning[i] + j) % 12 for j in range(nfrets + 1)]
+                        + [-1])
+                  for i in range(n))
+
+    # masks[i][j] is the same note as a pitch class mask (0 if muted).
+    masks = tuple(tuple([1 << note for note in notes[i][:-1]] + [0])
+                  for i in range(n))
+
+    # frets[i][note] lists the frets of string i that play note, from the
+    # start of the string upwards.
+    frets = tuple(tuple(tuple(j for j in range(stringstarts[i], nfrets + 1)
+                              if notes[i][j] == note)
+                        for note in range(12))
+                  for i in range(n))
+
+    return {"tuning"       : tuning,
+            "nfrets"       : nfrets,
+            "stringstarts" : stringstarts,
+            "notes"        : notes,
+            "masks"        : masks,
+            "frets"        : frets}
+
+def build(tuning, nfrets, stringstarts):
+    """
+    Returns the fretboard tables of an instrument as a dict with entries:
+    - "notes": notes[i][j] is the note played on string i at fret j, and
+      notes[i][-1] is -1, so that muted strings can be looked up too;
+    - "masks": the same as a pitch class mask, 0 for muted strings;
+    - "frets": frets[i][note] is the tuple of frets on string i (from
+      stringstarts[i] up to nfrets) which play note.
+    The tables are immutable and built only once per instrument.
+    """
+    return cached(tuple(tuning), nfrets, tuple(stringstarts[:len(tuning)]))
+
+def valids(table, chord, nmute, fretspec = 0):
+    """
+    Returns the list of valid frets on each string for a chord, i.e. the
+    frets playing a note of the chord at or above fretspec, preceded by -1
+    on the first nmute strings.
+    """
+    out = []
+    notes = set([note for note in chord if 0 <= note < 12])
+    for i in range(len(table["tuning"])):
+        start = max(table["stringstarts"][i], fretspec)
+        frets = sorted([j for note in notes for j in table["frets"][i][note]
+                        if j >= start])
+        if i < nmute:
+            frets = [-1] + frets
+        out.append(frets)
+    return out
@@ -0,0 +1,224 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                               identify.py  ##
+##                                                                           ##
+##  This file does the opposite of the rest of ThatChord: it takes a list    ##
+##  of frets on an instrument and names the chord they play. Every chord     ##
+##  ThatChord knows (every quality on every root, over every bass note) is   ##
+##  indexed by its notes once, so naming a chord is a dictionary lookup.     ##
+##  Run it with                                                              ##
+##      python3 identify.py 3 2 0 0 0 3 -i GUITAR                            ##
+##  with x for muted strings.                                                ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import functools
+
+from errors import err
+
+import dicts
+import pcset
+
+# How roots and bass notes are written in the names given.
+NAMES = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
+
+@functools.lru_cache(maxsize = 1)
+def chords():
+    """
+    Returns the list of every chord as (mask, bass, name, notes) tuples:
+    the pitch class mask of its notes, its bass note, its name and its notes
+    in order. Each quality is taken on every root, over every bass note.
+    Only the first of the qualities with the same intervals in
+    dicts.qualities is used (so "maj7" is left out, since "M7" comes
+    first). Chords in root position come first, then inversions, then
+    chords over a bass note they don't have, and within each of these,
+    chords come in the order of their quality in dicts.qualities. So the
+    first chord with some notes has the best name for them.
+    """
+    qualities = []
+    seen = set()
+    for quality, intervals in dicts.qualities.items():
+        if quality is None:
+            continue
+        m = pcset.mask(intervals)
+        if not m in seen:
+            seen.add(m)
+            qualities.append((quality, intervals))
+
+    out = []
+    for place in range(len(qualities)):
+        quality, intervals = qualities[place]
+        for root in range(12):
+            chord = [(root + i) % 12 for i in intervals]
+            for bass in range(12):
+                if bass == root:
+                    name = NAMES[root] + quality
+                    notes = chord
+                else:
+                    name = NAMES[root] + quality + "/" + NAMES[bass]
+                    notes = [bass] + [n for n in chord if n != bass]
+                out.append(((bass != root, not bass in chord, place, name),
+                            (pcset.mask(notes), bass, name, tuple(notes))))
+    return [chord for _, chord in sorted(out)]
+
+@functools.lru_cache(maxsize = 1)
+def index():
+    """
+    Returns the index of every chord: a dict mapping (mask, bass) to the
+    list of (name, notes) of the chords with these notes over this bass,
+    best name first (see chords).
+    """
+    out = {}
+    for m, bass, name, notes in chords():
+        out.setdefault((m, bass), []).append((name, notes))
+    return out
+
+@functools.lru_cache(maxsize = 8)
+def arrays(important):
+    # chords() as numpy arrays, for partial matches: the mask of each chord,
+    # its bass, and the mask of its first 'important' notes (all of them if
+    # important is 0).
+    import numpy as np
+    listed = chords()
+    if important == 0:
+        important = 12
+    return (np.array([m for m, bass, name, notes in listed]),
+            np.array([bass for m, bass, name, notes in listed]),
+            np.array([pcset.mask(notes[:important])
+                      for m, bass, name, notes in listed]))
+
+# POPCOUNT[m] is the number of notes in the mask m.
+POPCOUNT = [pcset.popcount(m) for m in range(1 << 12)]
+
+def parse(tokens):
+    """
+    returns the list of frets written in tokens, e.g. ["x", "3", "2"], with
+    -1 for muted strings (x).
+    """
+    out = []
+    for token in tokens:
+        if token.strip().upper() == "X":
+            out.append(-1)
+            continue
+        try:
+            out.append(int(token))
+        except ValueError:
+            err("identify")
+    return out
+
+def played(frets, table, order):
+    """
+    returns the pitch class mask of the notes played by frets on the
+    instrument of the fretboard table (see fretboard.py), and the note on
+    the lowest string played (lowest by order, as in rank.rank_bass), or -1
+    if every string is muted. Raises err("identify") unless frets has a
+    fret of the instrument (or -1) for each of its strings.
+    """
+    m = 0
+    bass = -1
+    lowest = None
+    notes = table["notes"]
+    if len(frets) != len(notes):
+        err("identify")
+    for i in range(len(frets)):
+        if frets[i] != -1:
+            if not table["stringstarts"][i] <= frets[i] <= table["nfrets"]:
+                err("identify")
+            note = notes[i][frets[i]]
+            m |= 1 << note
+            if lowest is None or order[i] < lowest:
+                lowest = order[i]
+                bass = note
+    return m, bass
+
+def candidates(frets, table, order, important = 0, count = 5):
+    """
+    returns the names of the chords frets could be playing, best first, at
+    most count of them, as a list of (name, notes) tuples. Chords with
+    exactly these notes over this bass come first, straight from the index.
+    If there are fewer than count of them, every chord is ranked by how
+    well it matches: first whether frets play its first 'important' notes
+    (every note if important is 0), as find requires of the options it
+    lists, then by the number of notes frets play which it doesn't have,
+    whether it has the same bass, and the number of its notes frets don't
+    play. Ranking needs numpy. Returns an empty list if every string is muted.
+    """
+    m, bass = played(frets, table, order)
+    if m == 0:
+        return []
+    return list(matches(m, bass, important, count))
+
+@functools.lru_cache(maxsize = 4096)
+def matches(m, bass, important, count):
+    # candidates, given the notes played. Shared by every fret list playing
+    # the same notes over the same bass.
+    exact = index().get((m, bass), [])
+    if len(exact) >= count:
+        return tuple(exact[:count])
+
+    import numpy as np
+    masks, basses, needed = arrays(important)
+    popcount = np.array(POPCOUNT)
+    # a single key, with the chords' own order breaking ties.
+    key = (((needed & ~m) != 0) * 4096
+           + popcount[m & ~masks] * 256
+           + (basses != bass) * 128
+           + popcount[masks & ~m]) * len(masks) + np.arange(len(masks))
+    count = min(count, len(key))
+    best = np.argpartition(key, count - 1)[:count]
+    best = best[np.argsort(key[best])]
+    listed = chords()
+    return tuple([listed[i][2:] for i in best])
+
+def identify(frets, table, order, important = 0):
+    """
+    returns the name of the chord frets play on the instrument of the
+    fretboard table (see fretboard.py), e.g. "Am7/C", or the best partial
+    match (see candidates) if no chord plays exactly these notes.
+    """
+    found = candidates(frets, table, order, important, count = 1)
+    if found == []:
+        err("identify")
+    return found[0][0]
+
+def identify_many(frets_list, table, order, important = 0):
+    """
+    returns identify(frets, ...) for each frets in frets_list. Fret lists
+    are looked up once, so repeated fragments of a tab cost nothing more.
+    """
+    names = {}
+    out = []
+    for frets in frets_list:
+        key = tuple(frets)
+        if not key in names:
+            names[key] = identify(frets, table, order, important)
+        out.append(names[key])
+    return out
+
+if __name__ == "__main__":
+    import argparse
+    import settings
+
+    parser = argparse.ArgumentParser(prog = "identify.py",
+                                     usage = ("python3 identify.py <frets> "
+                                              + "[OPTIONS]"))
+    parser.add_argument("frets", nargs = "+", type = str,
+                        help = "fret on each string, x if muted")
+    parser.add_argument("-i", "--instrument", nargs = "?", type = str,
+                        help = "instrument preset")
+    parser.add_argument("-n", "--number", nargs = "?", type = int,
+                        default = 1,
+                        help = "number of names to list")
+    args = parser.parse_args()
+
+    s, _, _ = settings.get_settings(instrument_preset = args.instrument)
+    frets = parse(args.frets)
+    for name, notes in candidates(frets, s["fretboard"], s["order"],
+                                  s["important"], args.number):
+        print(name)
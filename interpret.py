@@ -21,15 +21,38 @@ from errors import err
 # we'll need reg exps for this bit
 import re
 
+# parsed requests are memoized
+import functools
+
 # we'll also need dictionaries from other files
 import dicts
 
+# pitch class sets
+from pcset import PCSet
+
 # Define regexp for structure of input string
 structure =   r"([a-gA-G][b#]?)"       \
             + r"(\d*[ac-zA-Z\+]*\d*)" \
             + r"(\(([b#]+\d+)+\))?"    \
             + r"(/([a-gA-G][b#]?))?$"
 
+# The same, and the structure of a single alteration, compiled once.
+STRUCTURE  = re.compile(structure)
+ALTERATION = re.compile(r"([b#]+)(\d+)")
+
+# Extra symbols removed from requests before they are parsed.
+STRIP = str.maketrans("", "", " ,._;:|><*")
+
+# Immutable copies of the dicts: parsing can't change them.
+QUALITIES = {key : tuple(value) for key, value in dicts.qualities.items()}
+
+# Number of requests whose parse is kept (see parse).
+CACHE_SIZE = 4096
+
+# Canonical keys of the chords seen so far, each mapped to itself (see
+# canonical).
+INTERNED = {}
+
 
 # Define handly helper functions
 def pm(s):
@@ -53,44 +76,32 @@ def hv(n):
     if n > 0:
         return 0
 
-# our main function
-def interpret(ss):
-    """
-    takes a string and returns a list of numbers. 0 = C; 1 = C#; ...; 11 = B.
-    """
-    
-    # start by removing extra symbols
-    s = ss.translate({ord(c) : None for c in " ,._;:|><*"})
-    
-    # create copies of the dicts to avoid changes bleeding over
-    notes = dict(dicts.notes)
-    alterations = dict(dicts.alterations)
-    qualities = dict(dicts.qualities)
+@functools.lru_cache(maxsize = CACHE_SIZE)
+def cached(s):
+    # s has had its extra symbols removed, so that requests which only
+    # differ by those share an entry.
     
     # match to regexp
-    m = re.match(structure, s)
+    m = STRUCTURE.match(s)
     if not m:
         err(1)
     W, X, Y, Z = m.group(1), m.group(2), m.group(3), m.group(6)
     
     try:
-        out = qualities[X].copy()
+        out = list(QUALITIES[X])
     except KeyError:
         err(1)
     
-    # deal with any alterations here.
+    # deal with any alterations here, in one pass over the parentheses.
     # TODO is this the best way to deal with alterations? Do we need to take
     # more context into accout, e.g. major/minor?
     if Y:
-        Y = Y[1 : -1] # remove parentheses from match
-        while Y != "":
-            m = re.match(r"([b#]+)(\d+)", Y) # first remaining alteration
-            
+        for m in ALTERATION.finditer(Y):
             # extract important information from alteration
             alt = sum([pm(i) for i in m.group(1)]) # so bb becomes -2
             num = int(m.group(2))
             try:
-                pair = alterations[num]
+                pair = dicts.alterations[num]
             except KeyError:
                 err(2)
             
@@ -109,15 +120,14 @@ def interpret(ss):
                     out.append(note_add)
                 # TODO definitely if alterations are >= 2 in either direction,
                 # the strategy for removing notes should be different
-            Y = Y[m.end():] # remove this alteration
     
     # Scale everything to the correct key
-    root = notes[W[0]] + pm(W[1 : 2])
+    root = dicts.notes[W[0]] + pm(W[1 : 2])
     out = [(root + n) % 12 for n in out]
     
     if Z:
         # a bass note was supplied
-        bass = (notes[Z[0]] + pm(Z[1 : 2])) % 12
+        bass = (dicts.notes[Z[0]] + pm(Z[1 : 2])) % 12
         if bass in out:
             # move bass to front
             out.remove(bass)
@@ -126,4 +136,46 @@ def interpret(ss):
             
     # TODO test that alterations work
     
-    return out
\ No newline at end of file
+    return tuple(out)
+
+def parse(ss):
+    """
+    takes a string and returns a tuple of numbers. 0 = C; 1 = C#; ...; 11 = B.
+    The result of each request is kept (for the last CACHE_SIZE different
+    requests), so that chord charts which repeat the same few chords only
+    parse each once. It is a tuple so that it can't be changed by mistake.
+    """
+    return cached(ss.translate(STRIP))
+
+def canonical(ss):
+    """
+    returns the canonical key of the chord a string asks for: the tuple of
+    its notes, in order, and their PCSet. Requests which name the same chord
+    in different ways (synonyms such as "Cmaj7" and "CM7" or "C+" and
+    "Caug", and enharmonics such as "C#" and "Db") get equal keys, and in
+    fact the same key object, so caches keyed by it keep one entry per
+    chord. The PCSet alone is shared by all the orderings of the
+    same notes, e.g. "C6" and "Am7/C".
+    """
+    notes = parse(ss)
+    key = (notes, PCSet(notes))
+    return INTERNED.setdefault(key, key)
+
+def distinct(requests):
+    """
+    returns the number of different chords in a list of requests, and the
+    number of different sets of notes (see canonical).
+    """
+    keys = set([canonical(ss) for ss in requests])
+    return len(keys), len(set([chordset for notes, chordset in keys]))
+
+# our main function
+def interpret(ss, with_set = False):
+    """
+    takes a string and returns a list of numbers. 0 = C; 1 = C#; ...; 11 = B.
+    If with_set is True, returns the list along with its PCSet.
+    """
+    out = list(parse(ss))
+    if with_set:
+        return out, PCSet(out)
+    return out
@@ -0,0 +1,259 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                                library.py  ##
+##                                                                           ##
+##  This file builds and reads libraries of voicings: files listing every    ##
+##  playable fret combination of an instrument once and for all, with the    ##
+##  notes each one plays and the values of the ranking functions which do    ##
+##  not depend on the chord. find.py can then answer a chord by filtering    ##
+##  the library instead of enumerating anything.                             ##
+##                                                                           ##
+##  Build a library for an instrument preset with                            ##
+##      python3 library.py GUITAR                                            ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import os
+
+import rank
+import fretboard
+import constrain
+
+# The ranking functions which don't depend on the chord. Their values are
+# stored in the library, in this order.
+STORED = [rank.rankfuncs.index(f) for f in [rank.rank_reach,
+                                             rank.rank_spread,
+                                             rank.rank_fingers,
+                                             rank.rank_pitch_hi,
+                                             rank.rank_pitch_lo,
+                                             rank.rank_mute]]
+
+# Only voicings whose pressed frets are at most this far apart are stored,
+# otherwise libraries of long-necked instruments get very big. Searches
+# whose answer could be a wider voicing are left to find.
+DEFAULT_REACH = 5
+
+# Features are calculated this many voicings at a time when building.
+BLOCK = 65536
+
+def dtype(n):
+    """
+    returns the numpy record type of one voicing on n strings: its frets (-1
+    if muted), the mask of the notes it plays and the stored features.
+    """
+    import numpy as np
+    return np.dtype([("frets",    np.int8,   (n,)),
+                     ("notes",    np.uint16),
+                     ("features", np.int16,  (len(STORED),))])
+
+def voicings(tuning, nfrets, nmute, stringstarts, reach = DEFAULT_REACH):
+    """
+    returns the array of every playable combination of frets, one per row:
+    any of the first nmute strings may be muted as long as the muted strings
+    come first, and the pressed frets are at most reach apart (no limit if
+    reach is None).
+    """
+    import numpy as np
+    n = len(tuning)
+    rows = np.zeros((1, 0), dtype = np.int8)
+    for i in range(n):
+        frets = list(range(stringstarts[i], nfrets + 1))
+        if i < nmute:
+            frets = [-1] + frets
+        frets = np.array(frets, dtype = np.int8)
+        rows = np.hstack([np.repeat(rows, len(frets), axis = 0),
+                          np.tile(frets, len(rows))[:, None]])
+        # drop combinations as soon as they break a rule, to keep this small.
+        if i > 0:
+            rows = rows[~((rows[:, i] == -1) & (rows[:, i - 1] != -1))]
+        if reach is not None:
+            pressed = rows > np.array(stringstarts[:i + 1])
+            hi = np.where(pressed, rows, -1).max(axis = 1)
+            lo = np.where(pressed, rows, nfrets + 1).min(axis = 1)
+            rows = rows[~pressed.any(axis = 1) | (hi - lo <= reach)]
+    return rows
+
+def build(path, tuning, nfrets, nmute, stringstarts, reach = DEFAULT_REACH):
+    """
+    Builds the library of an instrument: the voicings go in path + ".npy",
+    in a fixed-width binary layout, and the instrument they are for in
+    path + ".yml".
+    """
+    import numpy as np
+    import yaml
+    n = len(tuning)
+    stringstarts = list(stringstarts[:n])
+    rows = voicings(tuning, nfrets, nmute, stringstarts, reach)
+    table = fretboard.build(tuning, nfrets, stringstarts)
+    masks = np.array(table["masks"], dtype = np.uint16)
+
+    records = np.zeros(len(rows), dtype = dtype(n))
+    records["frets"] = rows
+    for start in range(0, len(rows), BLOCK):
+        frets = rows[start:start + BLOCK].astype(np.int64)
+        notes = np.zeros(len(frets), dtype = np.uint16)
+        for i in range(n):
+            notes |= masks[i][frets[:, i]]
+        records["notes"][start:start + BLOCK] = notes
+        for j in range(len(STORED)):
+            records["features"][start:start + BLOCK, j] = \
+                rank.batchfuncs[STORED[j]](frets, [], tuning, [], stringstarts)
+
+    np.save(path + ".npy", records)
+    with open(path + ".yml", "w") as file:
+        yaml.dump({"tuning"       : list(tuning),
+                   "nfrets"       : nfrets,
+                   "nmute"        : nmute,
+                   "stringstarts" : stringstarts,
+                   "reach"        : reach,
+                   "voicings"     : len(records)}, file)
+
+def load(path):
+    """
+    returns the Library saved at path (without extension).
+    """
+    return Library(path)
+
+def lookup(directory, tuning, nfrets, nmute, stringstarts):
+    """
+    returns a Library from the folder directory which can answer searches
+    on the given instrument, or None if there is none.
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return None
+    for name in names:
+        if name.endswith(".yml"):
+            library = load(os.path.join(directory, name[:-4]))
+            if library.matches(tuning, nfrets, nmute, stringstarts):
+                return library
+    return None
+
+class Library:
+    """
+    A library of voicings, read from a file built by build. The voicings
+    are memory-mapped rather than read, so loading is instant and processes
+    reading the same library share its pages.
+    """
+    def __init__(self, path):
+        import numpy as np
+        import yaml
+        with open(path + ".yml", "r") as file:
+            self.meta = yaml.load(file, Loader=yaml.FullLoader)
+        self.records = np.load(path + ".npy", mmap_mode = "r")
+
+    def __len__(self):
+        return len(self.records)
+
+    def matches(self, tuning, nfrets, nmute, stringstarts):
+        """
+        returns True if the library was built for this instrument, or for
+        one with more frets or more strings which may be muted.
+        """
+        n = len(tuning)
+        return (self.meta["tuning"] == list(tuning)
+                and self.meta["stringstarts"] == list(stringstarts[:n])
+                and self.meta["nfrets"] >= nfrets
+                and self.meta["nmute"] >= nmute)
+
+    def search(self, chord, chordset, valids, index, tuning, order, ranks,
+               stringstarts, limits = None):
+        """
+        Returns the best 'index' options of the chord, as find_numpy would,
+        from the voicings in the library whose frets are all in valids and
+        which play all the notes of chordset (and are within the limits on
+        reach and fingers, if given: see constrain.limits). Returns None if
+        the answer might be a voicing too wide to be in the library.
+        """
+        import numpy as np
+        n = len(valids)
+        records = self.records
+        frets = records["frets"]
+
+        # allowed[i][f] says whether fret f is valid on string i (and the
+        # last column is for muted strings). position[i][f] is its place in
+        # valids, which breaks ties as in the counter loop.
+        width = max(self.meta["nfrets"], max([max(l) for l in valids])) + 2
+        allowed  = np.zeros((n, width), dtype = bool)
+        position = np.zeros((n, width), dtype = np.int64)
+        for i in range(n):
+            allowed[i][valids[i]] = True
+            position[i][valids[i]] = np.arange(len(valids[i]))
+
+        impmask = int(chordset)
+        keep = (records["notes"] & impmask) == impmask
+        for i in range(n):
+            keep &= allowed[i][frets[:, i]]
+        rows = np.flatnonzero(keep)
+
+        found = frets[rows].astype(np.int64)
+        if limits is not None:
+            keep = constrain.within(found, limits, stringstarts)
+            rows, found = rows[keep], found[keep]
+        stored = records["features"][rows]
+        known = {STORED[j] : stored[:, j] for j in range(len(STORED))}
+        scores = rank.rank_batch(found, chord, tuning, order, ranks,
+                                 stringstarts, known)
+        seq = np.zeros(len(rows), dtype = np.int64)
+        stride = 1
+        for i in range(n):
+            seq += position[i][found[:, i]] * stride
+            stride *= len(valids[i])
+        best = np.lexsort((seq, scores))[:index]
+        options = [(found[k].tolist(), scores[k].item()) for k in best]
+
+        reach = self.meta["reach"]
+        if reach is None or reach >= self.meta["nfrets"]:
+            return options
+        # every voicing within a narrower limit is in the library.
+        if limits is not None and limits[0] is not None and limits[0] <= reach:
+            return options
+        if len(options) == index and options[-1][1] < least(ranks, reach):
+            return options
+        return None
+
+def least(ranks, reach):
+    """
+    returns a rank which no voicing wider than reach can beat. Such a voicing
+    has a reach and spread of at least reach + 1, so at least two pressed
+    strings, the highest at fret reach + 2 or more. All other ranking
+    functions are at least 0, so this only holds if no coefficient is
+    negative: otherwise nothing can be ruled out.
+    """
+    if any(r < 0 for r in ranks):
+        return float("-inf")
+    lowest = {rank.rank_reach    : reach + 1,
+              rank.rank_spread   : reach + 1,
+              rank.rank_fingers  : 2,
+              rank.rank_pitch_hi : reach + 2}
+    return sum([ranks[rank.rankfuncs.index(f)] * lowest[f] for f in lowest])
+
+if __name__ == "__main__":
+    import argparse
+    import settings
+
+    parser = argparse.ArgumentParser(prog = "library.py",
+                                     usage = ("python3 library.py <instrument> "
+                                              + "[OPTIONS]"))
+    parser.add_argument("instrument", nargs = 1, type = str,
+                        help = "instrument preset")
+    parser.add_argument("-r", "--reach", nargs = "?", type = int,
+                        default = DEFAULT_REACH,
+                        help = ("widest distance between pressed frets of "
+                                + "the voicings stored"))
+    parser.add_argument("-d", "--directory", nargs = "?", type = str,
+                        help = "directory to save the library in")
+    args = parser.parse_args()
+
+    s, _, _ = settings.get_settings(instrument_preset = args.instrument[0])
+    directory = args.directory or s["library_loc"] or "library"
+    os.makedirs(directory, exist_ok = True)
+    build(os.path.join(directory, args.instrument[0].upper()), s["tuning"],
+          s["nfrets"], s["nmute"], s["stringstarts"], args.reach)
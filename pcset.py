@@ -0,0 +1,110 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                                  pcset.py  ##
+##                                                                           ##
+##  This file defines sets of pitch classes (0 = C, 1 = C#, ..., 11 = B)     ##
+##  stored as 12-bit integers: bit n is set iff note n is in the set. Union, ##
+##  intersection and difference are then single integer operations, which   ##
+##  is what the search loops in find.py and rank.py rely on.                 ##
+##                                                                           ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+# the mask with all 12 notes
+FULL = (1 << 12) - 1
+
+def mask(notes):
+    """
+    returns the 12-bit mask of a list (or any iterable) of notes.
+    """
+    out = 0
+    for note in notes:
+        out |= 1 << (note % 12)
+    return out
+
+def popcount(m):
+    """
+    returns the number of notes in the mask m.
+    """
+    return bin(m).count("1")
+
+def notes(m):
+    """
+    returns the list of notes in the mask m, from C upwards.
+    """
+    return [i for i in range(12) if m >> i & 1]
+
+def as_mask(notes):
+    """
+    returns notes as a mask, whether it is a mask already or a list of notes.
+    """
+    if isinstance(notes, int):
+        return int(notes)
+    return mask(notes)
+
+class PCSet(int):
+    """
+    A set of pitch classes, backed by its 12-bit mask. It can be used as an
+    int anywhere (e.g. in mask operations in the search loops), and behaves
+    like a set of notes otherwise:
+
+    PCSet([0, 4, 7]) | PCSet([7, 11]) == PCSet([0, 4, 7, 11])
+    PCSet([0, 4, 7]) - PCSet([7]) == PCSet([0, 4])
+    4 in PCSet([0, 4, 7]); len(PCSet([0, 4, 7])) == 3
+    """
+    def __new__(cls, notes = ()):
+        return super().__new__(cls, as_mask(notes) & FULL)
+
+    def __or__(self, other):
+        return PCSet(int(self) | as_mask(other))
+
+    def __and__(self, other):
+        return PCSet(int(self) & as_mask(other))
+
+    def __xor__(self, other):
+        return PCSet(int(self) ^ as_mask(other))
+
+    def __sub__(self, other):
+        return PCSet(int(self) & ~as_mask(other))
+
+    __ror__  = __or__
+    __rand__ = __and__
+    __rxor__ = __xor__
+
+    def __invert__(self):
+        return PCSet(FULL & ~int(self))
+
+    def __contains__(self, note):
+        return bool(int(self) >> (note % 12) & 1)
+
+    def __iter__(self):
+        return iter(notes(self))
+
+    def __len__(self):
+        return popcount(self)
+
+    def popcount(self):
+        return popcount(self)
+
+    def issubset(self, other):
+        return int(self) & ~as_mask(other) == 0
+
+    def issuperset(self, other):
+        return as_mask(other) & ~int(self) == 0
+
+    def transpose(self, n):
+        """
+        returns the set shifted up by n semitones.
+        """
+        n %= 12
+        m = int(self)
+        return PCSet(((m << n) | (m >> (12 - n))) & FULL)
+
+    def __repr__(self):
+        return "PCSet(" + str(notes(self)) + ")"
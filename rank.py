@@ -20,6 +20,9 @@
 # import error messages
 from errors import err
 
+# pitch class sets as 12-bit masks
+import pcset
+
 # define the pressed helper function since it is used in several ranking funcs
 def helper_pressed(frets, stringstarts):
     """
@@ -42,7 +45,7 @@ def helper_played(frets, stringstarts):
             out.append(frets[i])
     return out
 
-def rank_reach(frets, chord, tuning, order, stringstarts):
+def rank_reach(frets, chord, tuning, order, stringstarts, table = None):
     """
     Returns the distance between the highest and lowest fret that needs
     to be pressed when playing the chord
@@ -53,7 +56,7 @@ def rank_reach(frets, chord, tuning, order, stringstarts):
     else:
         return (max(pressed) - min(pressed))
 
-def rank_spread(frets, chord, tuning, order, stringstarts):
+def rank_spread(frets, chord, tuning, order, stringstarts, table = None):
     """
     Similar to reach, but includes empty strings as well, in order to measure
     how 'spread out' the chord sounds.
@@ -64,41 +67,46 @@ def rank_spread(frets, chord, tuning, order, stringstarts):
     else:
         return max(played) - min(played)
 
-def rank_fingers(frets, chord, tuning, order, stringstarts):
+def rank_fingers(frets, chord, tuning, order, stringstarts, table = None):
     """
     Returns the 'number of figners needed to play the chord', i.e. number
     of strings that are pressed.
     """
     return len(helper_played(frets, stringstarts))
 
-def rank_pitch_hi(frets, chord, tuning, order, stringstarts):
+def rank_pitch_hi(frets, chord, tuning, order, stringstarts, table = None):
     """
     This function prefers chords which are played lower on the fretboard.
     """
     return max(frets)
 
-def rank_pitch_lo(frets, chord, tuning, order, stringstarts):
+def rank_pitch_lo(frets, chord, tuning, order, stringstarts, table = None):
     """
     This function prefers chords which are played lower on the fretboard.
     """
     return min(helper_played(frets, stringstarts))
 
-def rank_full(frets, chord, tuning, order, stringstarts):
+def rank_full(frets, chord, tuning, order, stringstarts, table = None):
     """
     Assesses how many notes from the chord were hit.
     Only returns meaningful input if variable 'important' is set low.
     """
     
-    # make list of all notes played in the configuration
+    # make mask of all notes played in the configuration
     n = len(frets)
-    notes = []
-    for i in range(n):
-        if frets[i] != -1:
-            notes.append((tuning[i] + frets[i]) % 12)
+    notes = 0
+    if table:
+        masks = table["masks"]
+        for i in range(n):
+            notes |= masks[i][frets[i]]
+    else:
+        for i in range(n):
+            if frets[i] != -1:
+                notes |= 1 << ((tuning[i] + frets[i]) % 12)
     
-    return len(set(chord) - set(notes))
+    return pcset.popcount(pcset.mask(chord) & ~notes)
 
-def rank_mute(frets, chord, tuning, order, stringstarts):
+def rank_mute(frets, chord, tuning, order, stringstarts, table = None):
     """
     Disadvantages chords with muted strings.
     """
@@ -108,21 +116,13 @@ def rank_mute(frets, chord, tuning, order, stringstarts):
             count *= 2
     return count - 1
 
-def rank_structure(frets, chord, tuning, order, stringstarts):
+def rank_structure(frets, chord, tuning, order, stringstarts, table = None):
     """
     Assesses how well important notes in the chord have been placed on the
     low strings.
     """
     n = len(frets)
     
-    # first make a list of notes played, with -1 still meaning mute.
-    notes = []
-    for i in range(n):
-        if frets[i] < stringstarts[i]:
-            notes.append(-1)
-        else:
-            notes.append((tuning[i] + frets[i]) % 12)
-    
     # calculate how many muted strings there are
     m = 0
     for i in range(n):
@@ -133,27 +133,31 @@ def rank_structure(frets, chord, tuning, order, stringstarts):
     # m from each entry in order.
     order_norm = [i - m for i in order]
     
+    # make a mask of notes played, and for each of them find the lowest
+    # string (in order_norm) where it is played.
+    notes = 0
+    lowest = [0] * 12
+    for j in range(n):
+        if frets[j] >= stringstarts[j]:
+            if table:
+                note = table["notes"][j][frets[j]]
+            else:
+                note = (tuning[j] + frets[j]) % 12
+            if not notes >> note & 1 or order_norm[j] < lowest[note]:
+                lowest[note] = order_norm[j]
+            notes |= 1 << note
     
     # now check each note in chord. Most heavily weighted is the bass.
     out = 0
     for i in range(len(chord)):
-        if chord[i] in notes:
-            # in this case, find all places where played
-            places = []
-            for j in range(n):
-                if chord[i] == notes[j]:
-                    places.append(j)
-            
-            # find the lowest string where played
-            lowest = order_norm[min(places, key = lambda x : order_norm[x])]
-            
+        if notes >> chord[i] & 1:
             # add the distance away from ideal rank to out
-            out += abs(i - lowest) / (2 ** i)
+            out += abs(i - lowest[chord[i]]) / (2 ** i)
     
     # normalise by the number of non-muted strings
     return out / (len(frets) - m)
 
-def rank_bass(frets, chord, tuning, order, stringstarts):
+def rank_bass(frets, chord, tuning, order, stringstarts, table = None):
     """
     Penalises chords where the note played on the lowest string is not the bass
     """
@@ -173,7 +177,10 @@ def rank_bass(frets, chord, tuning, order, stringstarts):
     lowstr = ordernew.index(loword)
     
     # find note played on this string
-    lownot = (frets[lowstr] + tuning[lowstr]) % 12
+    if table:
+        lownot = table["notes"][lowstr][frets[lowstr]]
+    else:
+        lownot = (frets[lowstr] + tuning[lowstr]) % 12
     
     # return 0 iff note is the lowest note in chord.
     if lownot == chord[0]:
@@ -193,7 +200,303 @@ rankfuncs = [rank_reach,       \
              rank_structure,   \
              rank_bass]
 
-# define main rank function. "ranks" is list of coeffs.
-def rank(frets, chord, tuning, order, ranks, stringstarts):
-    return sum([ranks[i] * rankfuncs[i](frets, chord, tuning, order, stringstarts) \
-                for i in range(len(rankfuncs))])
+# define main rank function. "ranks" is list of coeffs. Metrics with a
+# coefficient of 0 are not evaluated. table, if given, is the instrument's
+# fretboard table (see fretboard.py), used to look up notes.
+def rank(frets, chord, tuning, order, ranks, stringstarts, table = None):
+    return sum([ranks[i] * rankfuncs[i](frets, chord, tuning, order, stringstarts, table) \
+                for i in range(len(rankfuncs)) if ranks[i] != 0])
+
+
+# Aggregates (see compile_ranks) of no strings at all, and a fret higher
+# than any.
+BIG = 1 << 30
+IDENTITY = (-1, BIG, -1, BIG, 0, 0, -2, 0)
+
+def compile_ranks(chord, tuning, order, ranks, stringstarts, table = None):
+    """
+    Returns a function scorer such that scorer(frets) is rank(frets, chord,
+    tuning, order, ranks, stringstarts), for use in search loops. Everything
+    that only depends on the arguments is worked out once here, the pressed
+    and played strings are found once for each option rather than once in
+    each ranking function, and functions with a coefficient of 0 are never
+    called. Ranks are added up in the same order as in rank, so that they
+    are exactly equal.
+    """
+    n = len(tuning)
+    starts = list(stringstarts[:n])
+    (w_reach, w_spread, w_fingers, w_pitch_hi, w_pitch_lo, w_full, w_mute,
+     w_structure, w_bass) = ranks
+    if table:
+        notes = table["notes"]
+    else:
+        # without a fretboard table, make one long enough for any fret.
+        notes = [[(tuning[i] + j) % 12 for j in range(max(starts) + 128)]
+                 + [-1] for i in range(n)]
+    chordmask = pcset.mask(chord)
+    bignum = max(order) + 1
+    weights = [2 ** i for i in range(len(chord))]
+    
+    def structure(frets):
+        # as in rank_structure
+        m = 0
+        for i in range(n):
+            if frets[i] == -1:
+                m = i + 1
+        mask = 0
+        lowest = [0] * 12
+        for j in range(n):
+            if frets[j] >= starts[j]:
+                note = notes[j][frets[j]]
+                if not mask >> note & 1 or order[j] - m < lowest[note]:
+                    lowest[note] = order[j] - m
+                mask |= 1 << note
+        total = 0
+        for i in range(len(chord)):
+            if mask >> chord[i] & 1:
+                total += abs(i - lowest[chord[i]]) / weights[i]
+        return total / (n - m)
+    
+    def bass(frets):
+        # as in rank_bass
+        lowstr = 0
+        loword = None
+        for i in range(n):
+            o = bignum if frets[i] < starts[i] else order[i]
+            if loword is None or o < loword:
+                lowstr, loword = i, o
+        return 0 if notes[lowstr][frets[lowstr]] == chord[0] else 1
+    
+    def scorer(frets):
+        # pressed and played frets, as in helper_pressed and helper_played
+        pressed = []
+        played = []
+        nmuted = 0
+        for i in range(n):
+            f = frets[i]
+            if f >= starts[i]:
+                played.append(f)
+                if f > starts[i]:
+                    pressed.append(f)
+            else:
+                nmuted += 1
+        
+        out = 0
+        if w_reach:
+            out += w_reach * (max(pressed) - min(pressed) if pressed else 0)
+        if w_spread:
+            out += w_spread * (max(played) - min(played) if played else 0)
+        if w_fingers:
+            out += w_fingers * len(played)
+        if w_pitch_hi:
+            out += w_pitch_hi * max(frets)
+        if w_pitch_lo:
+            out += w_pitch_lo * min(played)
+        if w_full:
+            mask = 0
+            for i in range(n):
+                if frets[i] != -1:
+                    mask |= 1 << notes[i][frets[i]]
+            out += w_full * pcset.popcount(chordmask & ~mask)
+        if w_mute:
+            out += w_mute * ((1 << nmuted) - 1)
+        if w_structure:
+            out += w_structure * structure(frets)
+        if w_bass:
+            out += w_bass * bass(frets)
+        return out
+    
+    # Loops which change a few strings at a time can instead keep track of
+    # the aggregates of the strings: the highest and lowest pressed fret,
+    # the highest and lowest played fret, the number of played and of muted
+    # strings, the highest fret and the mask of notes played. element gives
+    # them for one string, merge for two sets of strings together, and
+    # combine gives the rank from them (see find.walk_ranked).
+    def element(i, f):
+        if f < starts[i]:
+            return (-1, BIG, -1, BIG, 0, 1, f, 0)
+        if f == starts[i]:
+            return (-1, BIG, f, f, 1, 0, f, 1 << notes[i][f])
+        return (f, f, f, f, 1, 0, f, 1 << notes[i][f])
+    
+    def merge(a, b):
+        return (a[0] if a[0] > b[0] else b[0], a[1] if a[1] < b[1] else b[1],
+                a[2] if a[2] > b[2] else b[2], a[3] if a[3] < b[3] else b[3],
+                a[4] + b[4], a[5] + b[5], a[6] if a[6] > b[6] else b[6],
+                a[7] | b[7])
+    
+    def combine(frets, agg):
+        (hi_pressed, lo_pressed, hi_played, lo_played, nplayed, nmuted,
+         highest, mask) = agg
+        out = 0
+        if w_reach:
+            out += w_reach * (hi_pressed - lo_pressed if hi_pressed >= 0
+                              else 0)
+        if w_spread:
+            out += w_spread * (hi_played - lo_played if nplayed else 0)
+        if w_fingers:
+            out += w_fingers * nplayed
+        if w_pitch_hi:
+            out += w_pitch_hi * highest
+        if w_pitch_lo:
+            out += w_pitch_lo * lo_played
+        if w_full:
+            out += w_full * pcset.popcount(chordmask & ~mask)
+        if w_mute:
+            out += w_mute * ((1 << nmuted) - 1)
+        if w_structure:
+            out += w_structure * structure(frets)
+        if w_bass:
+            out += w_bass * bass(frets)
+        return out
+    
+    scorer.element = element
+    scorer.merge   = merge
+    scorer.combine = combine
+    return scorer
+
+
+# BATCH VERSIONS OF THE RANKING FUNCTIONS
+# Each of these takes a numpy array of frets with one candidate per row, and
+# returns an array with the value of the corresponding ranking function for
+# each row. They are used by the numpy engine in find.py.
+
+def batch_helper_masks(frets, stringstarts):
+    """
+    returns two boolean arrays saying which strings are pressed and which
+    are played, as in helper_pressed and helper_played.
+    """
+    import numpy as np
+    starts = np.array(stringstarts[:frets.shape[1]])
+    return frets > starts, frets >= starts
+
+def batch_helper_range(frets, mask):
+    """
+    returns max - min of the frets where mask is True in each row, or 0 if
+    mask is False on the whole row.
+    """
+    import numpy as np
+    big = np.iinfo(frets.dtype).max
+    hi = np.where(mask, frets, -big).max(axis = 1)
+    lo = np.where(mask, frets, big).min(axis = 1)
+    return np.where(mask.any(axis = 1), hi - lo, 0)
+
+def batch_helper_notes(frets, tuning):
+    """
+    returns the array of notes played on each string, with -1 for muted
+    strings.
+    """
+    import numpy as np
+    notes = (frets + np.array(tuning[:frets.shape[1]])) % 12
+    return np.where(frets == -1, -1, notes)
+
+def batch_reach(frets, chord, tuning, order, stringstarts):
+    pressed, _ = batch_helper_masks(frets, stringstarts)
+    return batch_helper_range(frets, pressed)
+
+def batch_spread(frets, chord, tuning, order, stringstarts):
+    _, played = batch_helper_masks(frets, stringstarts)
+    return batch_helper_range(frets, played)
+
+def batch_fingers(frets, chord, tuning, order, stringstarts):
+    _, played = batch_helper_masks(frets, stringstarts)
+    return played.sum(axis = 1)
+
+def batch_pitch_hi(frets, chord, tuning, order, stringstarts):
+    return frets.max(axis = 1)
+
+def batch_pitch_lo(frets, chord, tuning, order, stringstarts):
+    import numpy as np
+    _, played = batch_helper_masks(frets, stringstarts)
+    big = np.iinfo(frets.dtype).max
+    return np.where(played, frets, big).min(axis = 1)
+
+def batch_full(frets, chord, tuning, order, stringstarts):
+    import numpy as np
+    notes = batch_helper_notes(frets, tuning)
+    out = np.zeros(frets.shape[0], dtype = frets.dtype)
+    for note in set(chord):
+        out += ~(notes == note).any(axis = 1)
+    return out
+
+def batch_mute(frets, chord, tuning, order, stringstarts):
+    import numpy as np
+    starts = np.array(stringstarts[:frets.shape[1]])
+    return 2 ** (frets < starts).sum(axis = 1) - 1
+
+def batch_structure(frets, chord, tuning, order, stringstarts):
+    import numpy as np
+    n = frets.shape[1]
+    _, played = batch_helper_masks(frets, stringstarts)
+    notes = np.where(played, batch_helper_notes(frets, tuning), -1)
+    
+    # m is the number of muted strings, i.e. one more than the last muted one
+    m = np.where(frets == -1, np.arange(1, n + 1), 0).max(axis = 1)
+    
+    # for each note in the chord, find the lowest string (in the sense of
+    # order) where it is played, and compare to its ideal rank.
+    order = np.array(order)
+    big = n + max(order) + 1
+    out = np.zeros(frets.shape[0])
+    for i in range(len(chord)):
+        places = notes == chord[i]
+        lowest = np.where(places, order, big).min(axis = 1) - m
+        out += np.where(places.any(axis = 1), abs(i - lowest) / (2 ** i), 0)
+    
+    return out / (n - m)
+
+def batch_bass(frets, chord, tuning, order, stringstarts):
+    import numpy as np
+    starts = np.array(stringstarts[:frets.shape[1]])
+    order = np.array(order)
+    ordernew = np.where(frets < starts, max(order) + 1, order)
+    lowstr = ordernew.argmin(axis = 1)
+    rows = np.arange(frets.shape[0])
+    lownot = (frets[rows, lowstr] + np.array(tuning)[lowstr]) % 12
+    return (lownot != chord[0]).astype(frets.dtype)
+
+batchfuncs = [batch_reach,       \
+              batch_spread,      \
+              batch_fingers,     \
+              batch_pitch_hi,    \
+              batch_pitch_lo,    \
+              batch_full,        \
+              batch_mute,        \
+              batch_structure,   \
+              batch_bass]
+
+def features(frets, chord, tuning, order, stringstarts, ranks = None,
+             known = None):
+    """
+    Takes an array (or list of lists) of frets with one candidate per row,
+    and returns the matrix of all ranking functions, with one row per
+    candidate and one column per function in rankfuncs.
+    If ranks is given, columns with a coefficient of 0 are left at 0 and not
+    calculated. known is an optional dict of columns which have already
+    been calculated (e.g. stored in a library file), by column number.
+    """
+    import numpy as np
+    frets = np.asarray(frets, dtype = np.int64).reshape(-1, len(tuning))
+    out = np.zeros((frets.shape[0], len(batchfuncs)))
+    for i in range(len(batchfuncs)):
+        if known is not None and i in known:
+            out[:, i] = known[i]
+        elif ranks is None or ranks[i] != 0:
+            out[:, i] = batchfuncs[i](frets, chord, tuning, order,
+                                      stringstarts)
+    return out
+
+def rank_batch(frets, chord, tuning, order, ranks, stringstarts,
+               known = None):
+    """
+    Batch version of rank: returns the array of ranks of each row of frets.
+    This is the dot product of the feature matrix with ranks; columns are
+    added one at a time, in order, so that every entry is exactly equal to
+    what rank returns. known is passed on to features.
+    """
+    f = features(frets, chord, tuning, order, stringstarts, ranks, known)
+    out = f[:, 0] * 0
+    for i in range(len(ranks)):
+        if ranks[i] != 0:
+            out = out + ranks[i] * f[:, i]
+    return out
@@ -17,6 +17,101 @@
 ###############################################################################
 ###############################################################################
 
+import json
+import os
+
+# The parsed contents of settings.yml and of the instrument presets are kept
+# in this file (in the ThatChord directory), so that they are not parsed
+# again, and yaml not even imported, until one of them changes.
+SNAPSHOT = ".settings-snapshot.json"
+
+def sources(settings_path):
+    """
+    returns the paths of the yaml files get_settings may read: the settings
+    file and every instrument preset (including presets/instruments/
+    _index.yml).
+    """
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+    instruments = os.path.join(script_directory, "presets/instruments")
+    try:
+        names = sorted([name for name in os.listdir(instruments)
+                        if name.endswith(".yml")])
+    except OSError:
+        names = []
+    return [settings_path] + [os.path.join(instruments, name)
+                              for name in names]
+
+def stamps(paths):
+    """
+    returns the modification time and size of each file, or None for files
+    which don't exist. If these are the same, the files are taken to be too.
+    """
+    out = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            out[path] = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            out[path] = None
+    return out
+
+def load(settings_path):
+    """
+    returns a dict mapping the path of each yaml file get_settings may read
+    (see sources) to its parsed contents, or None if it doesn't exist.
+    These come from the snapshot if none of the files have changed since it
+    was made. Otherwise the files are parsed and the snapshot made again.
+    """
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+    snapshot_path = os.path.join(script_directory, SNAPSHOT)
+    paths = sources(settings_path)
+    found = stamps(paths)
+    try:
+        with open(snapshot_path, "r") as file:
+            saved = json.load(file)
+        if saved["stamps"] == found:
+            return saved["contents"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    import yaml
+    contents = {}
+    for path in paths:
+        contents[path] = None
+        if found[path] is not None:
+            with open(path, "r") as file:
+                contents[path] = yaml.load(file, Loader=yaml.FullLoader)
+    # written to a temporary file first, so that a process reading the
+    # snapshot meanwhile never sees half of it.
+    temporary = snapshot_path + "." + str(os.getpid())
+    try:
+        with open(temporary, "w") as file:
+            json.dump({"stamps" : found, "contents" : contents}, file)
+        os.replace(temporary, snapshot_path)
+    except (OSError, TypeError, ValueError):
+        # the snapshot is only there to save time, but a half-written
+        # temporary file is not left behind.
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+    return contents
+
+def preset(contents, path):
+    """
+    returns the parsed contents of the yaml file at path: from contents (see
+    load) if it is there, otherwise from the file, or None if there is no
+    such file. On case-insensitive file systems, a preset such as
+    MyBass.yml may be asked for as MYBASS.yml, which contents doesn't have.
+    """
+    if path in contents:
+        return contents[path]
+    if not os.path.isfile(path):
+        return None
+    import yaml
+    with open(path, "r") as file:
+        return yaml.load(file, Loader=yaml.FullLoader)
+
 def get_settings(settingsfile      = "settings.yml",
                  # NB.: settingsfile is relative to ThatChord directory.
                  instrument_preset = None,
@@ -41,6 +136,10 @@ def get_settings(settingsfile      = "settings.yml",
                  press             = None,
                  muted             = None,
                  top               = None,
+                 engine            = None,
+                 workers           = None,
+                 cache_loc         = None,
+                 library_loc       = None,
                  ):
 
     # firstly, put the manual assignments aside.
@@ -67,6 +166,10 @@ def get_settings(settingsfile      = "settings.yml",
     xpress             = press
     xmuted             = muted
     xtop               = top
+    xengine            = engine
+    xworkers           = workers
+    xcache_loc         = cache_loc
+    xlibrary_loc       = library_loc
 
 
     # PRIORITY LEVEL 1: default values for all variables.
@@ -99,105 +202,119 @@ def get_settings(settingsfile      = "settings.yml",
     muted  = "x"
     top = True
     
+    engine = "LOOP"
+    workers = 1
+    cache_loc = "NONE"
+    library_loc = "NONE"
+    
     
     # PRIORITY LEVEL 2: overwrite default values with settings loaded from
     #                   settings.yml.
     
-    import yaml
-    import os
     from errors import err
     import custom
     
     script_directory = os.path.dirname(os.path.realpath(__file__))
     settings_path = os.path.join(script_directory, settingsfile)
-    try:
-        with open(settings_path, "r") as file:
-            content = yaml.load(file, Loader=yaml.FullLoader)
-            keys = content.keys()
-            
-            if "presets" in keys:
-                for d in content["presets"]:
-                    if "instrument" in d.keys():
-                        instrument_preset = list(d.values())[0].upper()
-                    if "ranking" in d.keys():
-                        ranking_preset = list(d.values())[0].upper()
-            else:
-                err(20)
-            
-            if "input" in keys:
-                for d in content["input"]:
-                    if "how" in d.keys():
-                        input_type = list(d.values())[0].upper()
-            else:
-                err(20)
-            
-            if "output" in keys:
-                for d in content["output"]:
-                    if "how" in d.keys():
-                        output_method = list(d.values())[0].upper()
-                    if "format" in d.keys():
-                        output_format = list(d.values())[0].upper()
-            else:
-                err(20)
-            
-            if "saving" in keys:
-                for d in content["saving"]:
-                    if "method" in d.keys():
-                        save_method = list(d.values())[0].upper()
-                    if "location" in d.keys():
-                        save_loc = list(d.values())[0]
-            else:
-                err(20)
-            
-            if "custom_instrument" in keys:
-                for d in content["custom_instrument"]:
-                    if "tuning" in d.keys():
-                        tuning = custom.interpret(list(d.values())[0],
-                                                  remove_duplicates = False)
-                    if "nfrets" in d.keys():
-                        nfrets = list(d.values())[0]
-                    if "nmute" in d.keys():
-                        nmute = list(d.values())[0]
-                    if "important" in d.keys():
-                        important = list(d.values())[0]
-                    if "order" in d.keys():
-                        order = list(d.values())[0].copy()
-                    if "handedness" in d.keys():
-                        handedness = list(d.values())[0].upper()
-                        if handedness in ["LEFT", "RIGHT"]:
-                            left = {"LEFT" : True, "RIGHT" : False}[handedness]
-                    if "stringstarts" in d.keys():
-                        stringstarts = list(d.values())[0].copy()
-            else:
-                err(20)
-            
-            if "custom_ranking" in keys:
-                for d in content["custom_ranking"]:
-                    if "ranks" in d.keys():
-                        ranks = list(d.values())[0].copy()
-            else:
-                err(20)
-                
-            if "graphical_parameters" in keys:
-                for d in content["graphical_parameters"]:
-                    if "height" in d.keys():
-                        height = list(d.values())[0]
-                    if "margin" in d.keys():
-                        margin = list(d.values())[0]
-                    if "head" in d.keys():
-                        head = list(d.values())[0]
-                    if "string" in d.keys():
-                        string = list(d.values())[0]
-                    if "press" in d.keys():
-                        press = list(d.values())[0]
-                    if "muted" in d.keys():
-                        muted = list(d.values())[0]
-                    if "title_at_top" in d.keys():
-                        top = list(d.values())[0]
-            else:
-                err(20)
-    except FileNotFoundError:
+    contents = load(settings_path)
+    content = contents[settings_path]
+    if content is None:
         err(19)
+    keys = content.keys()
+    
+    if "presets" in keys:
+        for d in content["presets"]:
+            if "instrument" in d.keys():
+                instrument_preset = list(d.values())[0].upper()
+            if "ranking" in d.keys():
+                ranking_preset = list(d.values())[0].upper()
+    else:
+        err(20)
+    
+    if "input" in keys:
+        for d in content["input"]:
+            if "how" in d.keys():
+                input_type = list(d.values())[0].upper()
+    else:
+        err(20)
+    
+    if "output" in keys:
+        for d in content["output"]:
+            if "how" in d.keys():
+                output_method = list(d.values())[0].upper()
+            if "format" in d.keys():
+                output_format = list(d.values())[0].upper()
+    else:
+        err(20)
+    
+    if "saving" in keys:
+        for d in content["saving"]:
+            if "method" in d.keys():
+                save_method = list(d.values())[0].upper()
+            if "location" in d.keys():
+                save_loc = list(d.values())[0]
+    else:
+        err(20)
+    
+    if "custom_instrument" in keys:
+        for d in content["custom_instrument"]:
+            if "tuning" in d.keys():
+                tuning = custom.interpret(list(d.values())[0],
+                                          remove_duplicates = False)
+            if "nfrets" in d.keys():
+                nfrets = list(d.values())[0]
+            if "nmute" in d.keys():
+                nmute = list(d.values())[0]
+            if "important" in d.keys():
+                important = list(d.values())[0]
+            if "order" in d.keys():
+                order = list(d.values())[0].copy()
+            if "handedness" in d.keys():
+                handedness = list(d.values())[0].upper()
+                if handedness in ["LEFT", "RIGHT"]:
+                    left = {"LEFT" : True, "RIGHT" : False}[handedness]
+            if "stringstarts" in d.keys():
+                stringstarts = list(d.values())[0].copy()
+    else:
+        err(20)
+    
+    if "custom_ranking" in keys:
+        for d in content["custom_ranking"]:
+            if "ranks" in d.keys():
+                ranks = list(d.values())[0].copy()
+    else:
+        err(20)
+        
+    if "graphical_parameters" in keys:
+        for d in content["graphical_parameters"]:
+            if "height" in d.keys():
+                height = list(d.values())[0]
+            if "margin" in d.keys():
+                margin = list(d.values())[0]
+            if "head" in d.keys():
+                head = list(d.values())[0]
+            if "string" in d.keys():
+                string = list(d.values())[0]
+            if "press" in d.keys():
+                press = list(d.values())[0]
+            if "muted" in d.keys():
+                muted = list(d.values())[0]
+            if "title_at_top" in d.keys():
+                top = list(d.values())[0]
+    else:
+        err(20)
+    
+    # search settings are optional, older settings files lack them.
+    if "search" in keys:
+        for d in content["search"]:
+            if "engine" in d.keys():
+                engine = list(d.values())[0].upper()
+            if "workers" in d.keys():
+                workers = list(d.values())[0]
+            if "cache" in d.keys():
+                cache_loc = list(d.values())[0]
+            if "library" in d.keys():
+                library_loc = list(d.values())[0]
    
     
     # PRIORITY LEVEL 3: MANUAL ASSIGNMENTS.
@@ -246,6 +363,14 @@ def get_settings(settingsfile      = "settings.yml",
         muted = xmuted
     if xtop:
         top = xtop
+    if xengine:
+        engine = xengine.upper()
+    if xworkers is not None:
+        workers = xworkers
+    if xcache_loc:
+        cache_loc = xcache_loc
+    if xlibrary_loc:
+        library_loc = xlibrary_loc
     
     # APPLY PRESETS: firstly remove -L tag
     if instrument_preset[-2:] == "-L":
@@ -256,26 +381,21 @@ def get_settings(settingsfile      = "settings.yml",
     script_directory = os.path.dirname(os.path.realpath(__file__))
     preset_path = os.path.join(script_directory,
                                "presets/instruments/" + instrument_preset + ".yml")
-    ymldict = {}
-    try:
-        with open(preset_path, "r") as file:
-            ymldict = yaml.load(file, Loader=yaml.FullLoader)
-    except FileNotFoundError:
+    ymldict = preset(contents, preset_path)
+    if ymldict is None:
+        ymldict = {}
         # if there is no file with correct name, see if index can redirect
         index_path = os.path.join(script_directory,
                                   "presets/instruments/_index.yml")
-        with open(index_path, "r") as file:
-            index = yaml.load(file, Loader=yaml.FullLoader)
-            if instrument_preset in index.keys():
-                preset_path = os.path.join(script_directory,
-                                           ("presets/instruments/" +
-                                           index[instrument_preset] +
-                                           ".yml"))
-                try:
-                    with open(preset_path, "r") as file:
-                        ymldict = yaml.load(file, Loader=yaml.FullLoader)
-                except FileNotFoundError:
-                    pass
+        index = preset(contents, index_path)
+        if index is None:
+            raise FileNotFoundError(index_path)
+        if instrument_preset in index.keys():
+            preset_path = os.path.join(script_directory,
+                                       ("presets/instruments/" +
+                                       index[instrument_preset] +
+                                       ".yml"))
+            ymldict = preset(contents, preset_path) or {}
 
     # if a settings file was found, its contents are now in ymldict.
     keys = ymldict.keys()
@@ -337,6 +457,12 @@ def get_settings(settingsfile      = "settings.yml",
     
     if output_method == "PRINT" and not output_format == "TEXT":
         err("incompatible output")
+    
+    if not engine in ["LOOP", "NUMPY", "BNB", "DP"]:
+        err("engine")
+    
+    if not (isinstance(workers, int) and workers >= 0):
+        err("workers")
         
     if len(tuning) != len(order):
         err(17)
@@ -348,6 +474,10 @@ def get_settings(settingsfile      = "settings.yml",
     for i in range(len(tuning)):
         tuning[i] = (tuning[i] - stringstarts[i]) % 12
     
+    # BUILD FRETBOARD TABLES ONCE - for find and rank
+    import fretboard
+    table = fretboard.build(tuning, nfrets, stringstarts)
+    
     # MAKE GRAPHICAL PARAMETERS DICTIONARY - for output functions
     kwgrargs = {
             "height"       : height,
@@ -382,6 +512,13 @@ def get_settings(settingsfile      = "settings.yml",
             "output_format" : output_format,
             "output_method" : output_method,
             "save_method"   : save_method,
-            "save_loc"      : save_loc}
+            "save_loc"      : save_loc,
+            "engine"        : engine,
+            "workers"       : workers,
+            "cache_loc"     : (None if str(cache_loc).upper() == "NONE" else
+                               os.path.expanduser(cache_loc)),
+            "library_loc"   : (None if str(library_loc).upper() == "NONE" else
+                               os.path.expanduser(library_loc)),
+            "fretboard"     : table}
     
     return settings, kwgrargs, kwioargs
@@ -0,0 +1,222 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                                   song.py  ##
+##                                                                           ##
+##  This file reads whole songs, either in ChordPro format (chords in        ##
+##  square brackets in the lyrics, e.g. "[G]Twinkle twinkle [C]little       ##
+##  star") or as plain chord charts (lines of chords only), and gives the    ##
+##  diagram of every chord in them. Each chord is only searched for once,    ##
+##  however often it comes up. Run it with                                   ##
+##      python3 song.py songbook.cho                                         ##
+##  taking the same options as thatchord.py.                                 ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+import re
+import time
+
+from errors import ChordError
+
+import interpret
+import custom
+import find
+import output
+
+# ChordPro chords are in square brackets, and directives in braces on a line
+# of their own, e.g. {title: Yesterday}.
+CHORD     = re.compile(r"\[([^\]]*)\]")
+DIRECTIVE = re.compile(r"^\s*\{\s*([\w-]+)\s*(?::(.*))?\}\s*$")
+
+# Directives which start a new song, and which give the song's title.
+NEW_SONG = ["new_song", "ns"]
+TITLE    = ["title", "t"]
+
+def notes(symbol):
+    """
+    returns the tuple of notes of a chord symbol, as a request to thatchord.py
+    would give them (without index or fret).
+    """
+    if symbol[0:6].upper() == "CUSTOM":
+        return tuple(custom.interpret(symbol[6:]))
+    return interpret.parse(symbol)
+
+def is_chord(symbol):
+    try:
+        notes(symbol)
+    except ChordError:
+        return False
+    return True
+
+def symbols(line):
+    """
+    returns the chord symbols on a line: those in square brackets if there
+    are any, otherwise every word of the line if they are all chords (bar
+    lines of a chord chart are left out), otherwise none.
+    """
+    found = [symbol.strip() for symbol in CHORD.findall(line)]
+    if found != []:
+        return [symbol for symbol in found if symbol != ""]
+    words = line.replace("|", " ").split()
+    if words != [] and all([is_chord(word) for word in words]):
+        return words
+    return []
+
+def events(lines):
+    """
+    Generator over what happens in a stream of lines (e.g. an open file),
+    one line at a time: ("song", title) when a song starts (title is None
+    until it is given), ("title", title) when it is named afterwards, and
+    ("chord", symbol) for each chord. Songs are separated by {new_song}
+    directives, or by a second {title}.
+    """
+    started = False
+    titled = False
+    for line in lines:
+        m = DIRECTIVE.match(line)
+        if m:
+            name = m.group(1).lower()
+            value = (m.group(2) or "").strip()
+            if name in NEW_SONG or (name in TITLE and titled):
+                started = False
+                titled = False
+            if name in TITLE:
+                if started:
+                    yield ("title", value)
+                else:
+                    yield ("song", value)
+                    started = True
+                titled = True
+            continue
+        if line.lstrip().startswith("#"):
+            # ChordPro comment
+            continue
+        for symbol in symbols(line):
+            if not started:
+                yield ("song", None)
+                started = True
+            yield ("chord", symbol)
+
+def solve(lines, tcsettings, kwgrargs = None, kwioargs = None, search = None):
+    """
+    Generator which reads songs from a stream of lines and outputs the
+    diagram of each chord of each song, as thatchord.py would with these
+    settings (see settings.get_settings), once per song. After each song, it
+    yields a report on it: a dict with its "title", the number of "chords"
+    in it, the number of different ones ("unique"), how many of those had
+    to be searched for ("solved") rather than being known from earlier
+    songs, the symbols which are not chords ThatChord can play
+    ("skipped"), and the "seconds" it took.
+
+    Lines are read one at a time, so any number of songs can be streamed
+    through. Only the solution of each different chord is kept, and the
+    chords of the current song. search is find.find by default, or e.g.
+    the get method of a cache.VoicingCache.
+    """
+    if search is None:
+        search = find.find
+    kwgrargs = kwgrargs or {}
+    kwioargs = kwioargs or {}
+    # solutions of the chords seen so far, by their notes (so synonyms
+    # such as Cmaj7 and CM7 share one).
+    solutions = {}
+    report = None
+    for kind, value in events(lines):
+        if kind == "song":
+            if report is not None:
+                report["seconds"] = time.perf_counter() - start
+                yield report
+            start = time.perf_counter()
+            report = {"title"   : value,
+                      "chords"  : 0,
+                      "unique"  : 0,
+                      "solved"  : 0,
+                      "skipped" : []}
+            shown = set()
+            continue
+        if kind == "title":
+            report["title"] = value
+            continue
+
+        try:
+            key = notes(value)
+            if not key in solutions:
+                s = tcsettings
+                solutions[key] = search(list(key),
+                                        nmute = s["nmute"],
+                                        important = s["important"],
+                                        nfrets = s["nfrets"],
+                                        tuning = s["tuning"],
+                                        order = s["order"],
+                                        ranks = s["ranks"],
+                                        stringstarts = s["stringstarts"],
+                                        engine = s["engine"],
+                                        workers = s["workers"],
+                                        table = s["fretboard"])
+                report["solved"] += 1
+        except ChordError:
+            report["skipped"].append(value)
+            continue
+        report["chords"] += 1
+        if not key in shown:
+            shown.add(key)
+            report["unique"] += 1
+            if tcsettings["output_format"] == "TEXT":
+                output.text(solutions[key], name = value, title = value,
+                            **kwgrargs, **kwioargs)
+            elif tcsettings["output_format"] == "PNG":
+                output.img(solutions[key], name = value, title = value,
+                           **kwgrargs, **kwioargs)
+
+    if report is not None:
+        report["seconds"] = time.perf_counter() - start
+        yield report
+
+if __name__ == "__main__":
+    import argparse
+    import settings
+
+    parser = argparse.ArgumentParser(prog = "song.py",
+                                     usage = ("python3 song.py <file> "
+                                              + "[OPTIONS]"))
+    parser.add_argument("file", nargs = 1, type = str,
+                        help = "ChordPro file or chord chart")
+    parser.add_argument("-c", "--configuration", nargs = "?", type = str,
+                        help = ".yml file to take settings from")
+    parser.add_argument("-i", "--instrument", nargs = "?", type = str,
+                        help = "instrument preset")
+    parser.add_argument("-r", "--ranking", nargs = "?", type = str,
+                        help = "ranking preset")
+    parser.add_argument("-f", "--format", nargs = "?", type = str,
+                        help = "output format: text or png")
+    parser.add_argument("-o", "--output", nargs = "?", type = str,
+                        help = "output method: print, splash or none")
+    parser.add_argument("-s", "--save", nargs = "?", type = str,
+                        help = "save method: single, library or none")
+    parser.add_argument("-d", "--directory", nargs = "?", type = str,
+                        help = "directory to save diagrams")
+    args = parser.parse_args()
+
+    override = {"instrument_preset" : args.instrument,
+                "ranking_preset"    : args.ranking,
+                "output_format"     : args.format,
+                "output_method"     : args.output,
+                "save_method"       : args.save,
+                "save_loc"          : args.directory}
+    if args.configuration:
+        override["settingsfile"] = args.configuration
+    tcsettings, kwgrargs, kwioargs = settings.get_settings(**override)
+
+    with open(args.file[0], "r") as file:
+        for report in solve(file, tcsettings, kwgrargs, kwioargs):
+            line = "%s: %d chords, %d different, %d searched for in %.3f s" % (
+                    report["title"] or "Untitled", report["chords"],
+                    report["unique"], report["solved"], report["seconds"])
+            if report["skipped"] != []:
+                line += " (skipped " + ", ".join(report["skipped"]) + ")"
+            print(line)
@@ -73,11 +73,17 @@ import rank
 import output
 import custom
 import settings
+import cache
+import library
+import constrain
 from errors import err
 
 # Load settings from file. All defaults here so empty input.
 tcsettings, kwgrargs, kwioargs = settings.get_settings()
 
+# By default, find the best way of playing the chord rather than counting them.
+count_only = False
+
 # First, figure out what the request is.
 if tcsettings["input_type"] == "CONSOLE":
     request = input("Enter request here: ")
@@ -91,11 +97,12 @@ elif tcsettings["input_type"] == "TERMINAL":
                                               "[OPTIONS]"))
 
     parser.add_argument("request", nargs = 1, type = str,
-            help = ("requested chord of form WX(Y)/Z:T, " +
+            help = ("requested chord of form WX(Y)/Z{C}:T, " +
                     "where W is the root note, "          +
                     "X is the chord quality, "            +
                     "Y is a list of alterations, "        +
                     "Z is the bass note, "                +
+                    "C are optional constraints, "        +
                     "and T is the desired index in the list"))
 
     parser.add_argument("-c", "--configuration", nargs = "?", type = str,
@@ -120,9 +127,14 @@ elif tcsettings["input_type"] == "TERMINAL":
     parser.add_argument("-d", "--directory", nargs = "?", type = str,
                         help = "directory to save diagrams")
 
+    parser.add_argument("-n", "--count", action = "store_true",
+                        help = ("print the number of ways of playing the " +
+                                "chord instead of a diagram"))
+
     args = parser.parse_args()
 
     request = args.request[0]
+    count_only = args.count
 
     # populate dict with kwargs
     override = {"instrument_preset" : args.instrument,
@@ -147,6 +159,9 @@ if request.upper() == "SETTINGS":
         os.system("open " + settings_path)
     exit()
 
+# Check whether constraints on the frets were given in braces.
+request, constraints = constrain.extract(request)
+
 # Check whether a specific position in the list was requested. If not, 1 is
 # default (best option).
 listpos = 1
@@ -160,6 +175,8 @@ if ":" in request:
         listpos = int(request[colon_positions[0] + 1:])
     except ValueError:
         err(15)
+    if listpos < 1:
+        err(15)
     # remove the colon bit from the request
     request = request[:colon_positions[0]]
     
@@ -193,17 +210,43 @@ else:
     title = request
     filename = request
 
-# Find the chord at the requested listpos.
-solution = find.find(chord,
-                     nmute = tcsettings["nmute"],
-                     important = tcsettings["important"],
-                     index = listpos,
-                     nfrets = tcsettings["nfrets"],
-                     tuning = tcsettings["tuning"],
-                     order = tcsettings["order"],
-                     ranks = tcsettings["ranks"],
-                     stringstarts = tcsettings["stringstarts"],
-                     fretspec = at)
+# If only the number of options was requested, print it and stop here.
+if count_only:
+    print(find.count_options(chord,
+                             nmute = tcsettings["nmute"],
+                             important = tcsettings["important"],
+                             nfrets = tcsettings["nfrets"],
+                             tuning = tcsettings["tuning"],
+                             stringstarts = tcsettings["stringstarts"],
+                             fretspec = at,
+                             table = tcsettings["fretboard"],
+                             constraints = constraints))
+    exit()
+
+# Find the chord at the requested listpos, in the cache if there is one.
+search = find.find
+if tcsettings["cache_loc"]:
+    search = cache.VoicingCache(location = tcsettings["cache_loc"]).get
+voicings = None
+if tcsettings["library_loc"]:
+    voicings = library.lookup(tcsettings["library_loc"], tcsettings["tuning"],
+                              tcsettings["nfrets"], tcsettings["nmute"],
+                              tcsettings["stringstarts"])
+solution = search(chord,
+                  nmute = tcsettings["nmute"],
+                  important = tcsettings["important"],
+                  index = listpos,
+                  nfrets = tcsettings["nfrets"],
+                  tuning = tcsettings["tuning"],
+                  order = tcsettings["order"],
+                  ranks = tcsettings["ranks"],
+                  stringstarts = tcsettings["stringstarts"],
+                  fretspec = at,
+                  engine = tcsettings["engine"],
+                  workers = tcsettings["workers"],
+                  library = voicings,
+                  constraints = constraints,
+                  table = tcsettings["fretboard"])
 
 
 # figure out what the output format is
@@ -0,0 +1,181 @@
+###############################################################################
+###############################################################################
+##                                                                           ##
+##  THATCHORD BY TOM CONTI-LESLIE                              benchmark.py  ##
+##                                                                           ##
+##  This file times some of the inner workings of ThatChord, to check that   ##
+##  changes made for speed actually pay off. It is not run by pytest: run    ##
+##  it directly with "python3 tst/benchmark.py", optionally followed by the  ##
+##  names of the benchmarks to run.                                          ##
+##                                                                           ##
+##                                                                           ##
+##  License: CC BY-SA 4.0                                                    ##
+##                                                                           ##
+##  Contact: tom (dot) contileslie (at) gmail (dot) com                      ##
+##                                                                           ##
+###############################################################################
+###############################################################################
+
+# Move out of testing folder (for imports)
+import sys
+sys.path.append(sys.path[0] + "/..")
+
+import time
+
+import interpret
+import find
+import rank
+import settings
+
+def guitar():
+    """
+    returns the find arguments for the guitar preset.
+    """
+    s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                    ranking_preset = "GUITAR")
+    return {"nmute"        : s["nmute"],
+            "important"    : s["important"],
+            "nfrets"       : s["nfrets"],
+            "tuning"       : s["tuning"],
+            "order"        : s["order"],
+            "ranks"        : s["ranks"],
+            "stringstarts" : s["stringstarts"]}
+
+def timed(f, repeat = 3):
+    """
+    returns the best time out of several runs of f, in milliseconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        f()
+        t = (time.perf_counter() - start) * 1000
+        if best is None or t < best:
+            best = t
+    return best
+
+def linear_insert(options, frets, index, r):
+    """
+    The sorted list that find used before Shortlist, kept here to compare.
+    """
+    tup = (frets.copy(), r)
+    l = len(options)
+    i = l
+    while i > 0 and r < options[i - 1][1]:
+        i -= 1
+    if l < index:
+        options.insert(i, tup)
+    elif i < l:
+        options.insert(i, tup)
+        options.pop()
+
+def bench_shortlist():
+    """
+    Keeping the best 'index' options on GUITAR: a sorted list against the
+    bounded heap in find.Shortlist, fed the same ranked options.
+    """
+    args = guitar()
+    chord = interpret.interpret("Gadd9")
+    _, chordset, valids, table = find.prepare(chord, args["nmute"],
+                                              args["important"],
+                                              args["nfrets"], args["tuning"],
+                                              args["stringstarts"])
+    # rank everything once, so only the top-k structure is timed.
+    ranked = [(frets.copy(), rank.rank(frets, chord, args["tuning"],
+                                       args["order"], args["ranks"],
+                                       args["stringstarts"], table))
+              for frets in find.walk(valids, chordset, table)]
+
+    print("Gadd9 on GUITAR: " + str(len(ranked)) + " options")
+    print("%8s %12s %12s %12s" % ("index", "list (ms)", "heap (ms)",
+                                  "find (ms)"))
+    for index in [1, 10, 100, 1000, 10000]:
+        def with_list():
+            options = []
+            for frets, r in ranked:
+                linear_insert(options, frets, index, r)
+        def with_heap():
+            shortlist = find.Shortlist(index)
+            for frets, r in ranked:
+                shortlist.add(frets, r)
+        def with_find():
+            find.find(chord, index = index, **args)
+        print("%8d %12.1f %12.1f %12.1f" % (index, timed(with_list),
+                                            timed(with_heap),
+                                            timed(with_find, 1)))
+
+def bench_rank():
+    """
+    Cost per option of rank.rank against the scorer from
+    rank.compile_ranks, on every option of a few chords on GUITAR.
+    """
+    args = guitar()
+    print("%8s %8s %12s %12s" % ("chord", "options", "rank (us)",
+                                 "compiled (us)"))
+    for name in ["Gadd9", "C", "E7/G#", "Bbmaj9"]:
+        chord = interpret.interpret(name)
+        chord, chordset, valids, table = find.prepare(chord, args["nmute"],
+                                                      args["important"],
+                                                      args["nfrets"],
+                                                      args["tuning"],
+                                                      args["stringstarts"])
+        options = [frets.copy() for frets in find.walk(valids, chordset,
+                                                       table)]
+        rankargs = (chord, args["tuning"], args["order"], args["ranks"],
+                    args["stringstarts"], table)
+        def with_rank():
+            for frets in options:
+                rank.rank(frets, *rankargs)
+        scorer = rank.compile_ranks(*rankargs)
+        def with_scorer():
+            for frets in options:
+                scorer(frets)
+        print("%8s %8d %12.2f %12.2f" % (name, len(options),
+                                         1000 * timed(with_rank)
+                                         / len(options),
+                                         1000 * timed(with_scorer)
+                                         / len(options)))
+
+def bench_loop():
+    """
+    The counter loop with every option ranked from scratch, against
+    find.walk_ranked, which only works out again what changed.
+    """
+    args = guitar()
+    print("%8s %8s %12s %12s" % ("chord", "options", "walk (ms)",
+                                 "ranked (ms)"))
+    for name in ["Gadd9", "C", "E7/G#", "Bbmaj9"]:
+        chord = interpret.interpret(name)
+        chord, chordset, valids, table = find.prepare(chord, args["nmute"],
+                                                      args["important"],
+                                                      args["nfrets"],
+                                                      args["tuning"],
+                                                      args["stringstarts"])
+        scorer = rank.compile_ranks(chord, args["tuning"], args["order"],
+                                    args["ranks"], args["stringstarts"],
+                                    table)
+        def with_walk():
+            for frets in find.walk(valids, chordset, table):
+                scorer(frets)
+        def with_ranked():
+            for frets, r in find.walk_ranked(valids, chordset, table,
+                                             scorer):
+                pass
+        print("%8s %8d %12.1f %12.1f" % (name, find.count_options(
+                                             chord, args["nmute"],
+                                             args["important"],
+                                             args["nfrets"], args["tuning"],
+                                             args["stringstarts"]),
+                                         timed(with_walk),
+                                         timed(with_ranked)))
+
+benchmarks = {"shortlist" : bench_shortlist,
+              "rank"      : bench_rank,
+              "loop"      : bench_loop}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks.keys())
+    for name in names:
+        print("== " + name + " ==")
+        benchmarks[name]()
+        print()
@@ -24,14 +24,27 @@ sys.path.append(sys.path[0] + "/..")
 # Testing module
 import pytest
 
+import itertools
+import os
+
 # Import ThatChord-specific error class
 from errors import ChordError
 
 # Import ThatChord functions for testing
 import interpret
 import find
+import rank
 import settings
 import output
+import custom
+import fretboard
+import cache
+import library
+import fit
+import constrain
+import identify
+import song
+from pcset import PCSet
 
 class TestInterpret:
 
@@ -84,6 +97,80 @@ class TestInterpret:
     def test_interpret_bass_02(self):
         assert interpret.interpret("E7/B")[0] == 11
 
+    # PITCH CLASS SETS
+    def test_interpret_withset(self):
+        notes, chordset = interpret.interpret("Am7/G", with_set = True)
+        assert notes == interpret.interpret("Am7/G")
+        assert chordset == PCSet([9, 0, 4, 7])
+        notes, chordset = custom.interpret("C Eb G", with_set = True)
+        assert notes == [0, 3, 7] and chordset == PCSet([0, 3, 7])
+
+    # CACHED PARSER
+    def test_interpret_parse(self):
+        interpret.cached.cache_clear()
+        parsed = interpret.parse("Cm7(b5)/Bb")
+        assert parsed == tuple(interpret.interpret("Cm7(b5)/Bb"))
+        # requests differing by extra symbols share an entry.
+        assert interpret.parse("C m7 (b5) / Bb") is parsed
+        assert interpret.cached.cache_info().misses == 1
+        # changing what interpret returns doesn't change the cache.
+        interpret.interpret("Cm7(b5)/Bb").append(1)
+        assert interpret.parse("Cm7(b5)/Bb") == parsed
+
+    # CANONICAL CHORDS
+    def test_interpret_canonical(self):
+        assert interpret.canonical("Cmaj7") is interpret.canonical("CM7")
+        assert interpret.canonical("Db") is interpret.canonical("C#")
+        notes, chordset = interpret.canonical("C6")
+        assert interpret.canonical("Am7/C") != (notes, chordset)
+        assert interpret.canonical("Am7/C")[1] == chordset
+        assert interpret.distinct(["C6", "Am7/C", "C", "CM", "Cmaj",
+                                   "Caug", "C+"]) == (4, 3)
+
+class TestPCSet:
+    
+    def test_pcset_operations(self):
+        cmaj = PCSet([0, 4, 7])
+        assert cmaj == 0b10010001
+        assert cmaj | PCSet([7, 11]) == PCSet([0, 4, 7, 11])
+        assert cmaj & PCSet([4, 5]) == PCSet([4])
+        assert cmaj - PCSet([7, 11]) == PCSet([0, 4])
+        assert len(cmaj) == cmaj.popcount() == 3
+        assert 4 in cmaj and 5 not in cmaj
+        assert list(cmaj) == [0, 4, 7]
+        assert cmaj.transpose(5) == PCSet([5, 9, 0])
+        assert PCSet([0, 4]).issubset(cmaj) and cmaj.issuperset([0])
+        assert isinstance(cmaj - PCSet([0]), PCSet)
+
+class TestFretboard:
+    
+    def test_fretboard_tables(self):
+        tuning = [7, 0, 4, 9]
+        stringstarts = [5, 0, 0, 0]
+        table = fretboard.build(tuning, 12, stringstarts)
+        assert fretboard.build(tuning, 12, stringstarts) is table
+        for i in range(4):
+            assert table["notes"][i][-1] == -1
+            for j in range(13):
+                assert table["notes"][i][j] == (tuning[i] + j) % 12
+        assert table["frets"][0][7] == (12,)
+        assert table["frets"][1][0] == (0, 12)
+        assert fretboard.valids(table, [0, 4, 7], 1, 3) == [[-1, 5, 9, 12],
+                                                             [4, 7, 12],
+                                                             [3, 8, 12],
+                                                             [3, 7, 10]]
+    
+    def test_fretboard_rank(self):
+        # ranking with the tables must give the same as ranking without them.
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        chord = interpret.interpret("G7/B")
+        args = (chord, s["tuning"], s["order"], s["ranks"], s["stringstarts"])
+        for frets in [[-1, 2, 0, 0, 0, 1], [3, 2, 0, 0, 0, 1],
+                      [-1, -1, 9, 10, 8, 10]]:
+            assert (rank.rank(frets, *args) ==
+                    rank.rank(frets, *args, s["fretboard"]))
+
 class TestFind:
     
     # TEST ON SMALL INPUTS
@@ -128,6 +215,29 @@ class TestFind:
                       ranks = [0, 0, 0, 0, 0, 0, 0, 0, 0],
                       stringstarts = [0, 0, 0, 0])
     
+    # CHECK THERE IS AN ERROR IF AN INDEX BELOW 1 IS REQUESTED
+    def test_find_zeroindex(self):
+        for engine in ["LOOP", "NUMPY", "BNB", "DP"]:
+            for index in [0, -1]:
+                with pytest.raises(ChordError):
+                    find.find([0, 4, 7],
+                              nmute = 0,
+                              important = 0,
+                              index = index,
+                              nfrets = 12,
+                              tuning = [7, 0, 4, 9],
+                              order = [2, 0, 1, 3],
+                              ranks = [1, 1, 1, 1, 1, 1, 1, 1, 1],
+                              stringstarts = [0, 0, 0, 0],
+                              engine = engine)
+        with pytest.raises(ChordError):
+            cache.VoicingCache().get([0, 4, 7],
+                                     index = 0,
+                                     tuning = [7, 0, 4, 9],
+                                     order = [2, 0, 1, 3],
+                                     ranks = [1, 1, 1, 1, 1, 1, 1, 1, 1],
+                                     stringstarts = [0, 0, 0, 0])
+    
     # BASIC CHECK HIGH UP NECK
     def test_find_highneck(self):
         find.find(interpret.interpret("F"),
@@ -207,8 +317,654 @@ class TestFind:
                   stringstarts = [0, 0, 0, 0])
         assert find.find.count == 90
     
+    # CHECK THAT COUNTING OPTIONS AGREES WITH FIND
+    def test_find_countoptions(self):
+        for preset in ["UKULELE", "GUITAR", "BANJO"]:
+            s, _, _ = settings.get_settings(instrument_preset = preset)
+            for request in ["C", "Cm", "G7", "Fmaj7/C"]:
+                for important in [0, 2]:
+                    args = {"nmute" : s["nmute"],
+                            "important" : important,
+                            "nfrets" : s["nfrets"],
+                            "tuning" : s["tuning"],
+                            "stringstarts" : s["stringstarts"],
+                            "fretspec" : 2}
+                    chord = interpret.interpret(request)
+                    find.find(chord,
+                              order = s["order"],
+                              ranks = [0, 0, 0, 0, 0, 0, 0, 0, 0],
+                              **args)
+                    assert find.count_options(chord, **args) == find.find.count
+        assert find.count_options(interpret.interpret("C"),
+                                  nmute = 0,
+                                  important = 0,
+                                  nfrets = 12,
+                                  tuning = [7, 0, 4, 9],
+                                  stringstarts = [0, 0, 0, 0]) == 90
+    
+    # CHECK THAT RANKED OPTIONS COME IN THE SAME ORDER AS FIND'S INDICES
+    def test_find_ranked(self):
+        s, _, _ = settings.get_settings(instrument_preset = "BANJO",
+                                        ranking_preset = "BANJO")
+        args = {"nmute" : s["nmute"],
+                "important" : s["important"],
+                "nfrets" : s["nfrets"],
+                "tuning" : s["tuning"],
+                "order" : s["order"],
+                "ranks" : s["ranks"],
+                "stringstarts" : s["stringstarts"]}
+        chord = interpret.interpret("D7")
+        expected = [find.find(chord, index = i, **args) for i in range(1, 9)]
+        ranked = find.Ranked(chord, **args)
+        assert len(ranked) == find.find.count
+        assert [next(ranked) for i in range(3)] == expected[:3]
+        assert ranked.page(3, 5) == expected[3:]
+        assert ranked.cursor == 8
+        assert ranked[0] == expected[0]
+        with pytest.raises(IndexError):
+            ranked[len(ranked)]
+    
+    # CHECK THAT THE SHORTLIST KEEPS THE BEST, EARLIEST FIRST AMONG TIES
+    def test_find_shortlist(self):
+        shortlist = find.Shortlist(3)
+        for frets, r in [([0, 0, 0, 3], 2),
+                         ([-1, 0, 0, 3], 1),
+                         ([2, 0, 0, 3], 2),
+                         ([5, 4, 3, 3], 1),
+                         ([0, 4, 3, 3], 1),
+                         ([0, 0, 12, 3], 0)]:
+            shortlist.add(frets, r)
+        assert shortlist.options() == [([0, 0, 12, 3], 0),
+                                       ([-1, 0, 0, 3], 1),
+                                       ([5, 4, 3, 3], 1)]
+    
+    # CHECK THAT SHARING THE LOOP BETWEEN PROCESSES GIVES THE SAME OPTIONS
+    def test_find_parallel(self, monkeypatch):
+        monkeypatch.setattr(find, "PARALLEL_THRESHOLD", 0)
+        for preset, workers in [("UKULELE", 2), ("GUITAR", 3)]:
+            s, _, _ = settings.get_settings(instrument_preset = preset,
+                                            ranking_preset = preset)
+            chord = interpret.interpret("Am7")
+            kwargs = {"nmute"        : s["nmute"],
+                      "important"    : 3,
+                      "nfrets"       : 7,
+                      "tuning"       : s["tuning"],
+                      "order"        : s["order"],
+                      "ranks"        : s["ranks"],
+                      "stringstarts" : s["stringstarts"]}
+            for index in [1, 2, 7, 40]:
+                serial = find.find(chord, index = index, **kwargs)
+                count = find.find.count
+                assert find.find(chord, index = index, workers = workers,
+                                 **kwargs) == serial
+                assert find.find.count == count
+    
+    # CHECK THAT FINDING MANY CHORDS AT ONCE AGREES WITH FINDING EACH ONE
+    def test_find_many(self):
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "index"        : 2,
+                  "nfrets"       : s["nfrets"],
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        chords = [interpret.interpret(c) for c in ["C6", "Am7/C", "G", "C6",
+                                                   "Am7"]]
+        assert (find.find_many(chords, table = s["fretboard"], **kwargs) ==
+                [find.find(chord, **kwargs) for chord in chords])
+        assert find.find_many.listed == 2
+    
+    # CHECK THAT RANKING AGAIN WITH NEW COEFFICIENTS AGREES WITH FIND
+    def test_find_candidates(self):
+        pytest.importorskip("numpy")
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : 3,
+                  "nfrets"       : 8,
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "stringstarts" : s["stringstarts"]}
+        chord = interpret.interpret("Am7")
+        candidates = find.Candidates(chord, **kwargs)
+        for ranks in [s["ranks"], [1, 2, 3, 1, 0, 0, 0, 0, 0],
+                      [2, 1, 3, 0, 1, 0, 3, 2, 1], [0, 0, 1, -1, 0, 2, 0, 0, 0]]:
+            for index in [1, 3, 25]:
+                assert (candidates.find(ranks, index) ==
+                        find.find(chord, index = index, ranks = ranks,
+                                  **kwargs))
+        assert len(candidates) == find.find.count
+        with pytest.raises(ChordError):
+            candidates.find(s["ranks"], 0)
+    
     # TODO maybe make a dict of lots of different counts here to test
     # esp. with different importance and muting settings
+    
+    # CHECK THAT MUTED STRINGS DO NOT COUNT AS A NOTE OF THE CHORD
+    def test_find_mutenotes(self):
+        # on guitar, a muted low E string must not count as a D#.
+        tuning = [4, 9, 2, 7, 11, 4]
+        find.find([0, 7, 3],
+                  nmute = 2,
+                  important = 6,
+                  index = 1,
+                  nfrets = 12,
+                  tuning = tuning,
+                  order = [0, 1, 2, 3, 4, 5],
+                  ranks = [0, 0, 0, 0, 0, 0, 0, 0, 0],
+                  stringstarts = [0, 0, 0, 0, 0, 0],
+                  keep_full_list = True)
+        for opt in find.find.full_list:
+            notes = {(tuning[i] + opt[i]) % 12 for i in range(6)
+                     if opt[i] != -1}
+            assert {0, 3, 7} <= notes
+    
+    # CHECK THAT THE NUMPY ENGINE AGREES WITH THE LOOP
+    def test_find_numpyengine(self):
+        pytest.importorskip("numpy")
+        for preset in ["UKULELE", "GUITAR", "BANJO"]:
+            s, _, _ = settings.get_settings(instrument_preset = preset,
+                                            ranking_preset = preset)
+            for request in ["C", "Cm", "G7", "Fmaj7/C", "Bbadd9"]:
+                for index in [1, 3]:
+                    results = []
+                    for engine in ["LOOP", "NUMPY"]:
+                        frets = find.find(interpret.interpret(request),
+                                          nmute = s["nmute"],
+                                          important = s["important"],
+                                          index = index,
+                                          nfrets = s["nfrets"],
+                                          tuning = s["tuning"],
+                                          order = s["order"],
+                                          ranks = s["ranks"],
+                                          stringstarts = s["stringstarts"],
+                                          engine = engine,
+                                          keep_full_list = True)
+                        results.append((frets, find.find.count,
+                                        find.find.full_list))
+                    assert results[0] == results[1]
+    
+    # CHECK THAT BRANCH AND BOUND AGREES WITH THE LOOP, AND PRUNES
+    def test_find_bnbengine(self):
+        for preset in ["UKULELE", "GUITAR", "BANJO"]:
+            s, _, _ = settings.get_settings(instrument_preset = preset,
+                                            ranking_preset = preset)
+            for request in ["C", "Cm", "G7", "Fmaj7/C", "Bbadd9"]:
+                for index in [1, 3]:
+                    results = []
+                    for engine in ["LOOP", "BNB"]:
+                        results.append(find.find(interpret.interpret(request),
+                                            nmute = s["nmute"],
+                                            important = s["important"],
+                                            index = index,
+                                            nfrets = s["nfrets"],
+                                            tuning = s["tuning"],
+                                            order = s["order"],
+                                            ranks = s["ranks"],
+                                            stringstarts = s["stringstarts"],
+                                            engine = engine))
+                    assert results[0] == results[1]
+                    assert find.find.pruned > 0
+    
+    # CHECK THAT DYNAMIC PROGRAMMING AGREES WITH THE LOOP
+    def test_find_dpengine(self):
+        for preset in ["UKULELE", "GUITAR", "BANJO"]:
+            for ranking in [preset, "CUSTOM"]:
+                s, _, _ = settings.get_settings(instrument_preset = preset,
+                                                ranking_preset = ranking,
+                                                ranks = [1, 1, 1, 1, 1, 1, 1,
+                                                         1, 1])
+                for request in ["Cm", "G7", "Fmaj7/C"]:
+                    for index in [1, 3]:
+                        results = []
+                        for engine in ["LOOP", "DP"]:
+                            results.append(find.find(
+                                    interpret.interpret(request),
+                                    nmute = s["nmute"],
+                                    important = s["important"],
+                                    index = index,
+                                    nfrets = s["nfrets"],
+                                    tuning = s["tuning"],
+                                    order = s["order"],
+                                    ranks = s["ranks"],
+                                    stringstarts = s["stringstarts"],
+                                    engine = engine))
+                        assert results[0] == results[1]
+        # negative coefficients, where partial ranks can't bound the rest.
+        for preset, request, important, index, ranks in [
+                ("GUITAR", "C", 0, 3, [0, 0, 0, -1, 0, 0, 0, 0, 0]),
+                ("GUITAR", "Dsus4", 2, 1,
+                 [0.5, 0.5, 0, -1, 1, -1, 0, 0.5, 1])]:
+            s, _, _ = settings.get_settings(instrument_preset = preset)
+            results = []
+            for engine in ["LOOP", "DP"]:
+                results.append(find.find(interpret.interpret(request),
+                                         nmute = s["nmute"],
+                                         important = important,
+                                         index = index,
+                                         nfrets = 9,
+                                         tuning = s["tuning"],
+                                         order = s["order"],
+                                         ranks = ranks,
+                                         stringstarts = s["stringstarts"],
+                                         engine = engine,
+                                         top = True))
+            assert results[0] == results[1]
+    
+    # CHECK THAT DYNAMIC PROGRAMMING STAYS QUICK ON BIG INSTRUMENTS
+    def test_find_dpbig(self):
+        # 8 strings with 24 frets: far too many combinations for the loop.
+        find.find(interpret.interpret("G13"),
+                  nmute = 2,
+                  important = 8,
+                  index = 1,
+                  nfrets = 24,
+                  tuning = [6, 11, 4, 9, 2, 7, 11, 4],
+                  order = [0, 1, 2, 3, 4, 5, 6, 7],
+                  ranks = [3, 0, 3, 1, 0, 5, 2, 5, 8],
+                  stringstarts = [0, 0, 0, 0, 0, 0, 0, 0],
+                  engine = "DP")
+        assert find.find.count < 1000
+
+    def test_find_deadline(self):
+        # with time to finish, an anytime search finds the best options;
+        # without, it still gives options, but doesn't claim they are best.
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "nfrets"       : 24,
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        for name in ["C", "Ebmaj7(#11)", "G13"]:
+            chord = interpret.interpret(name)
+            expected = find.find(chord, index = 5, top = True, **kwargs)
+            assert find.find.optimal
+            found = find.find(chord, index = 5, top = True,
+                              deadline_ms = 10000, **kwargs)
+            assert find.find.optimal
+            assert found == expected
+            found = find.find(chord, index = 50, top = True,
+                              deadline_ms = 0, **kwargs)
+            assert len(found) == 50
+            assert not find.find.optimal
+            _, _, valids, _ = find.prepare(chord, s["nmute"],
+                                           s["important"], 24, s["tuning"],
+                                           s["stringstarts"])
+            for frets in found:
+                assert all([frets[i] in valids[i] for i in range(6)])
+
+class TestCache:
+    
+    def test_cache_hits(self, tmp_path):
+        s, _, _ = settings.get_settings(instrument_preset = "UKULELE",
+                                        ranking_preset = "UKULELE")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "nfrets"       : s["nfrets"],
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        voicings = cache.VoicingCache(size = 1, depth = 5,
+                                      location = str(tmp_path))
+        chord = interpret.interpret("C")
+        for index in [1, 3, 5, 1]:
+            assert (voicings.get(chord, index = index, **kwargs) ==
+                    find.find(chord, index = index, **kwargs))
+        voicings.get(interpret.interpret("G"), **kwargs)
+        assert voicings.stats() == {"hits" : 3, "disk_hits" : 0, "misses" : 2,
+                                    "evictions" : 1, "size" : 1}
+        # C is gone from memory but not from disk.
+        voicings.get(chord, **kwargs)
+        assert voicings.stats()["disk_hits"] == 1
+        # results from another version of the search are not used.
+        voicings.clear()
+        voicings.version = "old"
+        voicings.get(chord, **kwargs)
+        assert voicings.stats()["misses"] == 3
+    
+    def test_cache_version(self, tmp_path):
+        # changing any module the search uses gives another version.
+        names = [os.path.basename(path) for path in cache.sources()]
+        for name in ["find.py", "rank.py", "fretboard.py", "pcset.py",
+                     "constrain.py"]:
+            assert name in names
+        copies = []
+        for path in cache.sources():
+            copy = tmp_path / os.path.basename(path)
+            with open(path, "r") as file:
+                copy.write_text(file.read())
+            copies.append(str(copy))
+        assert cache.version(copies) == cache.version()
+        fretboard_copy = tmp_path / "fretboard.py"
+        fretboard_copy.write_text(fretboard_copy.read_text() + "\n# new\n")
+        assert cache.version(copies) != cache.version()
+
+    def test_cache_shapes(self):
+        # a sweep through all keys must give the same as searching each key.
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "nfrets"       : 9,
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        shapes = cache.ShapeCache()
+        count = 0
+        for index in [1, 4]:
+            for root in ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab",
+                         "A", "Bb", "B", "C"]:
+                chord = interpret.interpret(root + "m7")
+                assert (shapes.get(chord, index = index, **kwargs) ==
+                        find.find(chord, index = index, **kwargs))
+                count += find.find.count
+        assert shapes.ranked < count
+        # an index below 1 is an error, even for a chord shifted from another.
+        shapes.get(interpret.interpret("C7"), **kwargs)
+        for request in ["C#7", "Bb7"]:
+            with pytest.raises(ChordError):
+                shapes.get(interpret.interpret(request), index = 0, **kwargs)
+
+class TestLibrary:
+    
+    def test_library_search(self, tmp_path):
+        np = pytest.importorskip("numpy")
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "nfrets"       : 9,
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        path = str(tmp_path / "GUITAR")
+        library.build(path, s["tuning"], 9, s["nmute"], s["stringstarts"],
+                      reach = 4)
+        voicings = library.load(path)
+        assert isinstance(voicings.records, np.memmap)
+        answered = 0
+        for name in ["C", "Am7", "E7/G#", "Bbmaj7"]:
+            chord = interpret.interpret(name)
+            _, chordset, valids, _ = find.prepare(chord, s["nmute"],
+                                                  s["important"], 9,
+                                                  s["tuning"],
+                                                  s["stringstarts"])
+            for index in [1, 5]:
+                found = voicings.search(chord, chordset, valids, index,
+                                        s["tuning"], s["order"], s["ranks"],
+                                        s["stringstarts"])
+                if found is not None:
+                    answered += 1
+                    assert found[-1][0] == find.find(chord, index = index,
+                                                     **kwargs)
+                assert (find.find(chord, index = index, library = voicings,
+                                  **kwargs) ==
+                        find.find(chord, index = index, **kwargs))
+        assert answered > 0
+        # with a negative coefficient, wide voicings can't be ruled out.
+        assert library.least([-1] + s["ranks"][1:], 4) == float("-inf")
+
+class TestConstrain:
+    
+    def test_constrain_parse(self):
+        parsed = constrain.parse("s6=0, s1=x, s2!3, s2!x, max=7, reach=3, "
+                                 + "fingers=3, nomute")
+        assert parsed == {"pins"       : {5 : 0, 0 : -1},
+                          "exclude"    : {1 : [3, -1]},
+                          "maxfret"    : 7,
+                          "maxreach"   : 3,
+                          "maxfingers" : 3,
+                          "nomute"     : True}
+        assert constrain.extract("G7{reach=3}@2:4") == ("G7@2:4",
+                                 constrain.parse("reach=3"))
+        assert constrain.extract("G7:4") == ("G7:4", None)
+        for request in ["G{s0=3}", "G{sa=3}", "G{span=3}", "G{reach=3",
+                        "G{reach=-1}", "G{max=3}{nomute}"]:
+            with pytest.raises(ChordError):
+                constrain.extract(request)
+    
+    @pytest.mark.parametrize("engine", ["LOOP", "NUMPY", "BNB", "DP"])
+    def test_constrain_find(self, engine):
+        # constraints rule options out, leaving the others in the same
+        # order.
+        if engine == "NUMPY":
+            pytest.importorskip("numpy")
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        kwargs = {"nmute"        : s["nmute"],
+                  "important"    : s["important"],
+                  "nfrets"       : s["nfrets"],
+                  "tuning"       : s["tuning"],
+                  "order"        : s["order"],
+                  "ranks"        : s["ranks"],
+                  "stringstarts" : s["stringstarts"]}
+        for text in ["reach=2", "fingers=3, s2!3", "s6=3, max=7, nomute"]:
+            constraints = constrain.parse(text)
+            limits = constrain.limits(constraints)
+            for name in ["G", "Am7"]:
+                chord = interpret.interpret(name)
+                everything = find.find(chord, index = 10 ** 6, top = True,
+                                       **kwargs)
+                _, _, valids, _ = find.prepare(chord, s["nmute"],
+                                               s["important"], s["nfrets"],
+                                               s["tuning"], s["stringstarts"],
+                                               constraints = constraints)
+                allowed = [frets for frets in everything
+                           if all([frets[i] in valids[i] for i in range(6)])
+                           and (limits is None or
+                                constrain.allows(frets, limits,
+                                                 s["stringstarts"]))]
+                assert (find.find(chord, index = 5, top = True,
+                                  engine = engine, constraints = constraints,
+                                  **kwargs) == allowed[:5])
+                if engine == "LOOP":
+                    assert find.find.count == len(allowed)
+                    assert (find.count_options(chord, s["nmute"],
+                                               s["important"], s["nfrets"],
+                                               s["tuning"], s["stringstarts"],
+                                               constraints = constraints)
+                            == len(allowed))
+        with pytest.raises(ChordError):
+            find.find(interpret.interpret("C"), engine = engine,
+                      constraints = constrain.parse("fingers=0"), **kwargs)
+        # pins and exclusions which leave a string nothing to play.
+        for text in ["s1=1", "s3=x", "s3!2, s3!5, s3!10, s3!14, s3!17"]:
+            with pytest.raises(ChordError, match = "constraints in braces"):
+                find.find(interpret.interpret("C"), engine = engine,
+                          constraints = constrain.parse(text), **kwargs)
+    
+    def test_constrain_pruned(self):
+        # limits are checked as frets are chosen, not once they all are.
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        chord, chordset, valids, table = find.prepare(
+                interpret.interpret("C"), s["nmute"], s["important"],
+                s["nfrets"], s["tuning"], s["stringstarts"])
+        walked = len(list(find.walk(valids, chordset, table, (1, None))))
+        assert 0 < walked < len(list(find.walk(valids, chordset, table)))
+        find.find.count = 0
+        find.find.visited = 0
+        find.find.pruned = 0
+        find.find_bnb(valids, chord, chordset, 1, s["tuning"], s["order"],
+                      s["ranks"], s["stringstarts"], table, limits = (1, None))
+        pruned = find.find.visited
+        find.find.visited = 0
+        find.find_bnb(valids, chord, chordset, 1, s["tuning"], s["order"],
+                      s["ranks"], s["stringstarts"], table)
+        assert pruned < find.find.visited
+    
+    def test_constrain_candidates(self, monkeypatch):
+        # the count of candidates within the limits, which decides whether
+        # the loop is shared between processes, never misses one.
+        s, _, _ = settings.get_settings(instrument_preset = "UKULELE")
+        starts = s["stringstarts"]
+        _, _, valids, _ = find.prepare(interpret.interpret("G7"), s["nmute"],
+                                       s["important"], s["nfrets"],
+                                       s["tuning"], starts)
+        every = list(itertools.product(*valids))
+        assert constrain.candidates(valids, None, starts) == len(every)
+        for limits in [(2, None), (None, 2), (3, 3), (0, 0)]:
+            within = [frets for frets in every
+                      if constrain.allows(frets, limits, starts)]
+            bound = constrain.candidates(valids, limits, starts)
+            assert len(within) <= bound < len(every)
+        # so a small constrained search stays serial.
+        def forked(*args):
+            raise AssertionError
+        monkeypatch.setattr(find, "find_parallel", forked)
+        monkeypatch.setattr(find, "PARALLEL_THRESHOLD", 200)
+        find.find(interpret.interpret("G7"),
+                  nmute = s["nmute"],
+                  important = s["important"],
+                  nfrets = s["nfrets"],
+                  tuning = s["tuning"],
+                  order = s["order"],
+                  ranks = s["ranks"],
+                  stringstarts = starts,
+                  workers = 2,
+                  constraints = constrain.parse("reach=2, fingers=3"))
+
+class TestIdentify:
+    
+    def test_identify_exact(self):
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR")
+        table, order = s["fretboard"], s["order"]
+        assert identify.identify([3, 2, 0, 0, 0, 3], table, order) == "G"
+        assert identify.identify([-1, 0, 2, 2, 1, 0], table, order) == "Am"
+        assert identify.identify([-1, 3, 2, 0, 1, 0], table, order) == "C"
+        assert identify.identify([0, 2, 2, 1, 3, 0], table, order) == "E7"
+        assert identify.identify([1, 0, 0, 2, 3, 1], table, order) == "Dm/F"
+        # the ukulele's lowest string is its second.
+        u, _, _ = settings.get_settings(instrument_preset = "UKULELE")
+        assert identify.identify([2, 0, 1, 0], u["fretboard"],
+                                 u["order"]) == "F/C"
+        with pytest.raises(ChordError):
+            identify.identify([-1] * 6, table, order)
+    
+    def test_identify_invalid(self):
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR")
+        table, order = s["fretboard"], s["order"]
+        assert identify.parse(["x", "3", "2", "0", "1", "X"]) == [-1, 3, 2,
+                                                                 0, 1, -1]
+        for tokens in [["x", "3", "2", "0", "1", "o"],
+                       ["x", "3", "2", "0", "1", "1.5"]]:
+            with pytest.raises(ChordError):
+                identify.parse(tokens)
+        for frets in [[3, 2, 0, 0, 0, s["nfrets"] + 1],
+                      [3, 2, 0, 0, 0, -2],
+                      [3, 2, 0, 0, 0]]:
+            with pytest.raises(ChordError):
+                identify.identify(frets, table, order)
+    
+    def test_identify_roundtrip(self):
+        # the name of the frets ThatChord gives for a chord has its notes.
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        found = []
+        for name in ["C", "Am7", "G7/B", "Dsus4", "Ebmaj7", "Bb9", "E7/G#"]:
+            found.append(find.find(interpret.interpret(name),
+                                   nmute = s["nmute"],
+                                   important = 0,
+                                   nfrets = s["nfrets"],
+                                   tuning = s["tuning"],
+                                   order = s["order"],
+                                   ranks = s["ranks"],
+                                   stringstarts = s["stringstarts"]))
+        names = identify.identify_many(found + found, s["fretboard"],
+                                       s["order"])
+        assert names[:7] == names[7:]
+        for frets, name in zip(found, names):
+            m, bass = identify.played(frets, s["fretboard"], s["order"])
+            assert PCSet(interpret.interpret(name)) == m
+            assert interpret.interpret(name)[0] == bass
+    
+    def test_identify_partial(self):
+        pytest.importorskip("numpy")
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR")
+        # a C7 chord missing its third, which isn't one of its first three
+        # notes, is still a C7 chord.
+        found = identify.candidates([-1, 3, 5, 3, -1, -1], s["fretboard"],
+                                    s["order"], important = 3, count = 3)
+        assert len(found) == 3
+        assert found[0][0] == "C7"
+        # notes no chord has are matched as closely as possible.
+        found = identify.candidates([0, 1, 2, 3, 4, 5], s["fretboard"],
+                                    s["order"], important = 4)
+        assert len(found) == 5
+
+class TestSong:
+    
+    def test_song_symbols(self):
+        assert song.symbols("[G]Twinkle twinkle [C]little [ ]star") == ["G",
+                                                                       "C"]
+        assert song.symbols("| Am  F | C G/B |") == ["Am", "F", "C", "G/B"]
+        assert song.symbols("Am I the one") == []
+        events = list(song.events(["{title: One}", "[G]a [C]b",
+                                   "{new_song}", "# comment", "D7 G",
+                                   "{t: Two}"]))
+        assert events == [("song", "One"), ("chord", "G"), ("chord", "C"),
+                          ("song", None), ("chord", "D7"), ("chord", "G"),
+                          ("title", "Two")]
+    
+    def test_song_solve(self):
+        s, g, io = settings.get_settings(instrument_preset = "UKULELE",
+                                         ranking_preset = "UKULELE",
+                                         output_format = "TEXT",
+                                         output_method = "NONE",
+                                         save_method = "NONE")
+        lines = ["{title: One}",
+                 "[C]Twinkle twinkle [F]little [C]star [N.C.]",
+                 "{title: Two}",
+                 "| Cmaj7 CM7 | G7 C |"]
+        searched = []
+        def search(chord, **kwargs):
+            searched.append(chord)
+            return find.find(chord, **kwargs)
+        reports = list(song.solve(iter(lines), s, g, io, search = search))
+        assert [(r["title"], r["chords"], r["unique"], r["solved"],
+                 r["skipped"]) for r in reports] == [
+                ("One", 3, 2, 2, ["N.C."]),
+                ("Two", 4, 3, 2, [])]
+        assert all([r["seconds"] >= 0 for r in reports])
+        assert len(searched) == 4
+
+class TestFit:
+    
+    def test_fit_preset(self):
+        # a corpus of ThatChord's own choices is fitted by its own ranks.
+        pytest.importorskip("numpy")
+        s, _, _ = settings.get_settings(instrument_preset = "UKULELE",
+                                        ranking_preset = "UKULELE")
+        corpus = []
+        for name in ["C", "G", "Am", "F", "D7", "Em", "Bb", "E7"]:
+            frets = find.find(interpret.interpret(name),
+                              nmute = s["nmute"],
+                              important = s["important"],
+                              nfrets = s["nfrets"],
+                              tuning = s["tuning"],
+                              order = s["order"],
+                              ranks = s["ranks"],
+                              stringstarts = s["stringstarts"])
+            corpus.append({"chord"      : name,
+                           "instrument" : "UKULELE",
+                           "frets"      : frets})
+        corpus.append({"chord" : "C", "instrument" : "UKULELE",
+                       "frets" : [0, 0, 1, 3]})
+        found = fit.problems(corpus)
+        assert len(found) == 8
+        assert fit.evaluate(found, s["ranks"]) == (1, 1)
+        ranks, score = fit.fit(found, start = [0] * 9, trials = 50)
+        assert score == (1, 1)
+        assert fit.evaluate(found, ranks) == score
 
 class TestRank:
     
@@ -244,6 +1000,76 @@ class TestRank:
                          ranks = ukesettings["ranks"],
                          stringstarts = ukesettings["stringstarts"]) == [2, 0, 0, 0]
     
+    # CHECK THAT THE BATCH RANKING FUNCTIONS AGREE WITH THE ORIGINALS
+    def test_rank_batch(self):
+        pytest.importorskip("numpy")
+        for preset in ["GUITAR", "BANJO"]:
+            s, _, _ = settings.get_settings(instrument_preset = preset,
+                                            ranking_preset = preset)
+            chord = interpret.interpret("Am7/G")
+            find.find(chord,
+                      nmute = s["nmute"],
+                      important = 2,
+                      index = 1,
+                      nfrets = 7,
+                      tuning = s["tuning"],
+                      order = s["order"],
+                      ranks = s["ranks"],
+                      stringstarts = s["stringstarts"],
+                      keep_full_list = True)
+            frets = find.find.full_list
+            args = (chord, s["tuning"], s["order"], s["stringstarts"])
+            matrix = rank.features(frets, *args)
+            for i in range(len(rank.rankfuncs)):
+                assert list(matrix[:, i]) == [rank.rankfuncs[i](f, *args)
+                                              for f in frets]
+            scores = rank.rank_batch(frets, chord, s["tuning"], s["order"],
+                                     s["ranks"], s["stringstarts"])
+            assert list(scores) == [rank.rank(f, chord, s["tuning"],
+                                              s["order"], s["ranks"],
+                                              s["stringstarts"])
+                                    for f in frets]
+    
+    # CHECK THAT THE COMPILED SCORER AGREES WITH RANK EXACTLY
+    def test_rank_compile(self):
+        for preset in ["GUITAR", "BANJO"]:
+            s, _, _ = settings.get_settings(instrument_preset = preset,
+                                            ranking_preset = preset)
+            chord = interpret.interpret("Am7/G")
+            find.find(chord,
+                      nmute = s["nmute"],
+                      important = 2,
+                      nfrets = 7,
+                      tuning = s["tuning"],
+                      order = s["order"],
+                      ranks = s["ranks"],
+                      stringstarts = s["stringstarts"],
+                      keep_full_list = True)
+            for ranks in [s["ranks"], [1, -2, 0, 0.5, 1, 1, 3, 1.5, 2]]:
+                args = (chord, s["tuning"], s["order"], ranks,
+                        s["stringstarts"])
+                for table in [None, s["fretboard"]]:
+                    scorer = rank.compile_ranks(*args, table)
+                    assert ([scorer(f) for f in find.find.full_list] ==
+                            [rank.rank(f, *args) for f in find.find.full_list])
+    
+    # CHECK THAT RANKS KEPT UP TO DATE IN THE LOOP ARE EXACT
+    def test_rank_walkranked(self):
+        s, _, _ = settings.get_settings(instrument_preset = "GUITAR",
+                                        ranking_preset = "GUITAR")
+        chord = interpret.interpret("E7/G#")
+        chord, chordset, valids, table = find.prepare(chord, s["nmute"], 3, 8,
+                                                      s["tuning"],
+                                                      s["stringstarts"])
+        for ranks in [s["ranks"], [1, 2, 3, 1, 0, 0, 0, 0, 0],
+                      [0, 1, 0, 2, 3, 1, 4, 0, 0]]:
+            args = (chord, s["tuning"], s["order"], ranks, s["stringstarts"])
+            scorer = rank.compile_ranks(*args, table)
+            assert ([(f.copy(), r) for f, r in
+                     find.walk_ranked(valids, chordset, table, scorer)] ==
+                    [(f.copy(), rank.rank(f, *args)) for f in
+                     find.walk(valids, chordset, table)])
+    
     # TODO test individual ranking funcs (require that new rank funcs be added
     # at end of list to avoid disrupting order of existing coeffs)
 
@@ -279,6 +1105,59 @@ class TestSettings:
         s2, _, _ = settings.get_settings(ranking_preset = "CUSTOM",
                                          ranks = [0, 0, 0, 0, 0, 0, 0, 1])
         assert s1["ranks"] != s2["ranks"]
+    
+    def test_settings_snapshot(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "SNAPSHOT", str(tmp_path / "snap.json"))
+        script_directory = sys.path[0] + "/.."
+        with open(script_directory + "/settings.yml", "r") as file:
+            text = file.read()
+        path = tmp_path / "settings.yml"
+        path.write_text(text.replace("engine: loop", "engine: bnb"))
+        expected = settings.get_settings(settingsfile = str(path))
+        assert expected[0]["engine"] == "BNB"
+        # the snapshot is read without yaml.
+        monkeypatch.setitem(sys.modules, "yaml", None)
+        assert settings.get_settings(settingsfile = str(path)) == expected
+        monkeypatch.delitem(sys.modules, "yaml")
+        # changing a file makes a new snapshot.
+        path.write_text(text.replace("engine: loop", "engine: dp"))
+        assert settings.get_settings(settingsfile = str(path))[0]["engine"] \
+            == "DP"
+        # contents which can't be saved leave no temporary file behind.
+        path.write_text(text + "\nunsaved: !!set {a: null}\n")
+        settings.get_settings(settingsfile = str(path))
+        assert sorted(os.listdir(tmp_path)) == ["settings.yml", "snap.json"]
+    
+    def test_settings_presetfile(self, tmp_path, monkeypatch):
+        # presets missing from the snapshot (e.g. asked for in another case
+        # on a case-insensitive file system) are read from their file.
+        monkeypatch.setattr(settings, "SNAPSHOT", str(tmp_path / "snap.json"))
+        expected = [settings.get_settings(instrument_preset = name)
+                    for name in ["BANJO", "UKULELE"]]
+        monkeypatch.setattr(settings, "sources", lambda path : [path])
+        assert [settings.get_settings(instrument_preset = name)
+                for name in ["BANJO", "UKULELE"]] == expected
+    
+    def test_settings_noyaml(self, tmp_path):
+        # once the snapshot is there, a run of thatchord.py never imports
+        # yaml, whatever else it imports.
+        import subprocess
+        script_directory = os.path.realpath(sys.path[0] + "/..")
+        script = "\n".join([
+                "import runpy, sys",
+                "sys.path.insert(0, %r)" % script_directory,
+                "import settings",
+                "settings.SNAPSHOT = %r" % str(tmp_path / "snap.json"),
+                "sys.argv = ['thatchord.py', 'Am7', '-f', 'text',",
+                "            '-o', 'none', '-s', 'none']",
+                "runpy.run_path(%r, run_name = '__main__')"
+                % os.path.join(script_directory, "thatchord.py"),
+                "print('yaml' in sys.modules)"])
+        runs = [subprocess.run([sys.executable, "-c", script],
+                               capture_output = True, text = True,
+                               check = True).stdout.split()[-1]
+                for i in range(2)]
+        assert runs == ["True", "False"]
 
 class TestOutput:
     